@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+asyncio interface for FAR and IFF files (requires Python 3.7)
+
+All file access is done with os.pread (see subfile.PositionalSubFile)
+in a thread pool of bounded size, so the event loop never blocks on
+disk I/O and any number of lookups and reads can run concurrently
+against one archive, e.g. with asyncio.gather:
+
+    async with await open_far("Global.far") as farfile:
+        datas = await asyncio.gather(*(farfile.read(name) for name in names))
+
+Every open() returns an AsyncReader with its own cursor, so readers do
+not interfere with each other.
+
+aclose() (also called when leaving "async with") waits for all reads
+still running on the file descriptor before closing it. close() does the
+same for synchronous code, blocking the calling thread.
+'''
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .far import FarFile
+from .iff import IffFile, ResourceQuery, NoMatchingIffResourceFound
+from .subfile import PositionalSubFile
+
+default_max_workers = 8
+
+def _run(executor, pending, func, *args):
+    '''
+    Runs func in executor and remembers the future in the set pending until it is done
+
+    @return asyncio future
+    '''
+    future = executor.submit(func, *args)
+    pending.add(future)
+    future.add_done_callback(pending.discard)
+    return asyncio.wrap_future(future, loop=asyncio.get_running_loop())
+
+def _release(fd, executor):
+    '''
+    Closes fd and shuts down executor, both may be None. Blocks, run it outside of the event loop
+    '''
+    if executor is not None:
+        executor.shutdown(wait=True)
+    if fd is not None:
+        os.close(fd)
+
+async def _wait_pending(pending):
+    '''
+    Waits until all futures in the set pending are done, including the ones added meanwhile
+    '''
+    loop = asyncio.get_running_loop()
+    while pending:
+        done, _ = await asyncio.wait([asyncio.wrap_future(future, loop=loop) for future in list(pending)])
+        for future in done:
+            if not future.cancelled():
+                future.exception() #the callers of _run get the exceptions, don't log them again
+
+async def _arelease(fd, executor, pending):
+    '''
+    Waits for the futures in pending, then runs _release in the default executor of the event loop
+    '''
+    await _wait_pending(pending)
+    await asyncio.get_running_loop().run_in_executor(None, _release, fd, executor)
+
+class AsyncReader(object):
+    '''
+    Read-only stream whose reads are coroutines executed in a thread pool
+    '''
+    def __init__(self, stream, archive):
+        '''
+        @param stream stream only used by this reader, e.g. a PositionalSubFile
+        @param archive _AsyncArchive the stream belongs to, runs the reads
+        '''
+        self.stream = stream
+        self.archive = archive
+
+    async def read(self, size=-1):
+        return await self.archive._run(self.stream.read, size)
+
+    async def readinto(self, b):
+        return await self.archive._run(self.stream.readinto, b)
+
+    async def readline(self, size=-1):
+        return await self.archive._run(self.stream.readline, size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        '''
+        Only moves the cursor, does not block
+        '''
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def close(self):
+        self.stream.close()
+
+class _AsyncArchive(object):
+    '''
+    Base class owning (or sharing) a file descriptor and a thread pool
+    '''
+    def __init__(self, fd, off, length, executor, owns_fd=False, owns_executor=False, pending=None):
+        '''
+        @param pending set of the futures running on fd, shared by all objects using fd
+        '''
+        self.fd = fd
+        self.off = off
+        self.length = length
+        self.executor = executor
+        self.owns_fd = owns_fd                  #whether close() closes fd
+        self.owns_executor = owns_executor      #whether close() shuts down executor
+        self.pending = pending if pending is not None else set()
+
+    def _run(self, func, *args):
+        return _run(self.executor, self.pending, func, *args)
+
+    def _stream(self):
+        '''
+        @return new PositionalSubFile for the archive. Each call of a
+                synchronous method gets its own, so they can run concurrently
+        '''
+        return PositionalSubFile(self.fd, self.off, self.length)
+
+    def _reader(self, off, length):
+        return AsyncReader(PositionalSubFile(self.fd, self.off + off, length), self)
+
+    def close(self):
+        '''
+        Waits for the reads still running, then closes the file descriptor and
+        the thread pool if they are owned. Blocks, use aclose in coroutines
+        '''
+        if self.fd is None:
+            return
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+        wait(list(self.pending))
+        if self.owns_fd:
+            os.close(self.fd)
+        self.fd = None
+
+    async def aclose(self):
+        '''
+        Like close, but awaits the reads still running and closes file descriptor
+        and thread pool outside of the event loop
+        '''
+        await _wait_pending(self.pending)
+        if self.fd is None:
+            return
+        fd, self.fd = self.fd, None
+        await _arelease(fd if self.owns_fd else None, self.executor if self.owns_executor else None, self.pending)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+async def _open_archive(cls, path, max_workers, executor, parse):
+    '''
+    Opens path and creates an object of cls after parse(PositionalSubFile) was run in the thread pool
+    '''
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        length = os.fstat(fd).st_size
+        parsed = await _run(executor, pending, parse, PositionalSubFile(fd, 0, length))
+    except:
+        #the parser may still be running if we were cancelled, shield the cleanup from another cancellation
+        await asyncio.shield(_arelease(fd, executor if owns_executor else None, pending))
+        raise
+    return cls(parsed, fd, 0, length, executor, True, owns_executor, pending)
+
+def _parse_iff(rescan):
+    def parse(stream):
+        if rescan is None:
+            return IffFile(stream)
+        return IffFile(stream, rescan)
+    return parse
+
+class AsyncFarFile(_AsyncArchive):
+    '''
+    asyncio counterpart of far.FarFile, create it with open_far
+    '''
+    def __init__(self, farfile, fd, off, length, executor, owns_fd=False, owns_executor=False, pending=None):
+        _AsyncArchive.__init__(self, fd, off, length, executor, owns_fd, owns_executor, pending)
+        self.farfile = farfile #far.FarFile providing the manifest
+
+    filenames = property(lambda self: self.farfile.filenames)
+
+    def get_entry(self, filename, normalize=False):
+        '''
+        see far.FarFile.get_entry, does not access the file
+        '''
+        return self.farfile.get_entry(filename, normalize)
+
+    async def open(self, filename, normalize=False):
+        '''
+        @return AsyncReader for the file in the archive
+        '''
+        entry = self.farfile.get_entry(filename, normalize)
+        return self._reader(entry.off, entry.len1)
+
+    async def read(self, filename, normalize=False):
+        '''
+        @return content of the file in the archive as bytes
+        '''
+        reader = await self.open(filename, normalize)
+        return await reader.read()
+
+    async def read_many(self, filenames, normalize=False):
+        '''
+        see far.FarFile.read_many
+        '''
+        return await self._run(self.farfile.read_many, list(filenames), self._stream(), normalize)
+
+    async def open_iff(self, filename, normalize=False, rescan=None):
+        '''
+        @return AsyncIffFile for an IFF file inside the archive, sharing file descriptor and
+                thread pool with this object
+        '''
+        entry = self.farfile.get_entry(filename, normalize)
+        off = self.off + entry.off
+        ifffile = await self._run(_parse_iff(rescan), PositionalSubFile(self.fd, off, entry.len1))
+        return AsyncIffFile(ifffile, self.fd, off, entry.len1, self.executor, pending=self.pending)
+
+class AsyncIffFile(_AsyncArchive):
+    '''
+    asyncio counterpart of iff.IffFile, create it with open_iff or AsyncFarFile.open_iff
+    '''
+    def __init__(self, ifffile, fd, off, length, executor, owns_fd=False, owns_executor=False, pending=None):
+        _AsyncArchive.__init__(self, fd, off, length, executor, owns_fd, owns_executor, pending)
+        self.ifffile = ifffile #iff.IffFile with loaded resource map
+
+    def find(self, typecode, resid):
+        '''
+        see iff.IffFile.find, does not access the file
+        '''
+        return self.ifffile.find(typecode, resid)
+
+    def query(self, query):
+        '''
+        see iff.IffFile.query, does not access the file
+        '''
+        return self.ifffile.query(query)
+
+    async def open(self, predicate):
+        '''
+        see iff.IffFile.open
+
+        @return AsyncReader for the resource data (including resource header)
+        '''
+        resfile = await self._run(self.ifffile.open, predicate, self._stream())
+        return AsyncReader(resfile, self)
+
+    async def open_resource(self, typecode, resid):
+        '''
+        see iff.IffFile.open_resource
+
+        @return AsyncReader for the resource data (including resource header)
+        '''
+        resfile = await self._run(self.ifffile.open_resource, typecode, resid, self._stream())
+        return AsyncReader(resfile, self)
+
+    async def read_resource(self, typecode, resid):
+        '''
+        @return resource data (including resource header) as bytes
+        '''
+        reader = await self.open_resource(typecode, resid)
+        return await reader.read()
+
+    async def read_many(self, resources):
+        '''
+        see iff.IffFile.read_many
+        '''
+        return await self._run(self.ifffile.read_many, list(resources), self._stream())
+
+    async def glob(self):
+        '''
+        see iff.IffFile.glob
+        '''
+        return await self._run(self.ifffile.glob, self._stream())
+
+async def open_far(path, max_workers=default_max_workers, executor=None):
+    '''
+    Opens a physical FAR file and reads its manifest without blocking the event loop
+
+    @param max_workers size of the thread pool used for all reads
+    @param executor concurrent.futures.Executor to use instead of an own thread pool. It is not shut down by close()
+    @return AsyncFarFile
+    '''
+    return await _open_archive(AsyncFarFile, path, max_workers, executor, FarFile)
+
+async def open_iff(path, max_workers=default_max_workers, executor=None, rescan=None):
+    '''
+    Opens a physical IFF file and reads its resource map without blocking the event loop
+
+    @param max_workers, executor see open_far
+    @param rescan see iff.IffFile
+    @return AsyncIffFile
+    '''
+    return await _open_archive(AsyncIffFile, path, max_workers, executor, _parse_iff(rescan))
+
+#Testcode
+
+from .gamedata_for_tests import requires_known_farfile, requires_known_iff_file, make_far_file, make_iff_file, make_iff_resource
+import tempfile
+
+def _run_until_complete(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+@requires_known_farfile
+def test_async_far_file(known_far_file):
+    farfile = FarFile(open(known_far_file.filename, "rb"))
+    expected = dict((fname, farfile.open(fname, open(known_far_file.filename, "rb")).read()) for fname in farfile.filenames)
+    async def read_all():
+        async with await open_far(known_far_file.filename, max_workers=4) as archive:
+            names = list(expected)*3
+            datas = await asyncio.gather(*(archive.read(name) for name in names))
+            assert list(zip(names, datas)) == [(name, expected[name]) for name in names]
+            assert await archive.read_many(expected) == expected
+    _run_until_complete(read_all())
+
+@requires_known_iff_file
+def test_async_iff_file(known_iff_file):
+    ifffile = IffFile(open(known_iff_file.filename, "rb"))
+    stream = open(known_iff_file.filename, "rb")
+    keys = [(row.typecode, row.resid) for row in ifffile.resource_map]
+    expected = [ifffile.open_resource(typecode, resid, stream).read() for typecode, resid in keys]
+    async def read_all():
+        async with await open_iff(known_iff_file.filename) as archive:
+            assert await asyncio.gather(*(archive.read_resource(*key) for key in keys)) == expected
+            assert await archive.glob() == known_iff_file.glob
+            try:
+                await archive.open(ResourceQuery("BHAV", 1))
+                assert False
+            except NoMatchingIffResourceFound:
+                pass
+    _run_until_complete(read_all())
+
+def test_async_synthetic_archive():
+    resources = [("BHAV", 4096, 16, "Main", b"b"*30), ("GLOB", 128, 0, "Semi-global file", b"\x0dPersonGlobals")]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "Objects.far")
+        with open(path, "wb") as f:
+            f.write(make_far_file([("person.iff", make_iff_file(resources)), ("data.bin", b"x"*1000)]))
+        async def read_all():
+            archive = await open_far(path, max_workers=2)
+            reads = [asyncio.ensure_future(archive.read("data.bin")) for i in range(20)]
+            await asyncio.sleep(0) #the reads are submitted to the thread pool
+            ifffile = await archive.open_iff("person.iff")
+            assert await ifffile.read_resource("BHAV", 4096) == make_iff_resource(*resources[0])
+            assert await ifffile.read_many([("GLOB", 128)]) == {("GLOB", 128): make_iff_resource(*resources[1])}
+            assert await ifffile.glob() == "PersonGlobals"
+            #aclose waits for the reads still running
+            await archive.aclose()
+            assert not archive.pending and archive.fd is None
+            assert all(read.done() for read in reads)
+            assert await asyncio.gather(*reads) == [b"x"*1000]*20
+            await archive.aclose()
+        _run_until_complete(read_all())
+
+def test_async_open_cancelled():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "Objects.far")
+        with open(path, "wb") as f:
+            f.write(make_far_file([("data.bin", b"x"*1000)]))
+        async def open_cancelled():
+            fds = set(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+            task = asyncio.ensure_future(open_far(path, max_workers=1))
+            await asyncio.sleep(0) #the parser is submitted to the thread pool
+            task.cancel()
+            try:
+                await task
+                assert False
+            except asyncio.CancelledError:
+                pass
+            if fds is not None:
+                assert set(os.listdir("/proc/self/fd")) == fds
+        _run_until_complete(open_cancelled())
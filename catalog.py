@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+Catalog of all IFF resources below a game data directory
+
+The catalog is a SQLite database listing every resource of every IFF
+file, loose or inside a FAR archive, together with its position in the
+physical file. It answers questions like "which archive contains BHAV
+4100" without opening any archive.
+
+Building the catalog walks the directory and indexes the files in
+parallel with a process pool. Rebuilding only indexes files whose size
+or modification time changed since the last build.
+
+Tables:
+    archives   id, path (absolute), mtime_ns, size
+    resources  archive_id, inner_path (path inside a FAR archive, '' for loose IFF files),
+               typecode, resid, flags, name, offset, size
+               offset is the absolute offset of the resource header in the physical file,
+               size includes the resource header
+'''
+
+import os
+import mmap
+import sqlite3
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from .far import MappedFarFile, FARIOError
+from .iff import IffFile, ResourceQuery
+from .subfile import SubFile, BufferSubFile
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resources (
+    archive_id INTEGER NOT NULL REFERENCES archives(id) ON DELETE CASCADE,
+    inner_path TEXT NOT NULL,
+    typecode TEXT NOT NULL,
+    resid INTEGER NOT NULL,
+    flags INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resources_type_id ON resources (typecode, resid);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+CREATE INDEX IF NOT EXISTS resources_archive ON resources (archive_id);
+'''
+
+archive_suffixes = (".far", ".iff")
+
+iff_signature = b"IFF FILE "
+
+def _iff_rows(buf, off, length, inner_path):
+    '''
+    @return list of resource rows for the IFF file at [off, off+length) of buf
+    @raise IOError if the IFF file cannot be read
+    '''
+    stream = BufferSubFile(buf, off, length)
+    try:
+        ifffile = IffFile(stream, lazy=True)
+        headers = ifffile.scan(stream)
+    except (IOError, struct.error, UnicodeDecodeError) as e:
+        raise IOError("%s: %s" % (inner_path, e) if inner_path else str(e))
+    return [(inner_path, header.typecode, header.resid, header.flags, header.name, off + header.offset, header.size)
+            for header in headers]
+
+def _index_file(path):
+    '''
+    Worker function run in the process pool
+
+    Files inside FAR archives which are no IFF files (no IFF signature) are skipped,
+    any IFF file which cannot be read makes the whole file fail.
+
+    @return tuple (path, rows, error) with rows as stored in the resources table
+            (without archive_id) and error a message or None
+    '''
+    rows = []
+    try:
+        with open(path, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return path, rows, None
+            if path.lower().endswith(".far"):
+                with MappedFarFile(fp) as farfile:
+                    for entry in farfile.entries:
+                        if farfile.mmap[entry.off:entry.off+len(iff_signature)] == iff_signature:
+                            rows.extend(_iff_rows(farfile.mmap, entry.off, entry.len1, entry.filename))
+            else:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    rows = _iff_rows(buf, 0, len(buf), "")
+                finally:
+                    buf.close()
+    except (IOError, FARIOError, struct.error, ValueError) as e: #ValueError includes UnicodeDecodeError of names
+        return path, [], str(e)
+    return path, rows, None
+
+class _OwningSubFile(SubFile):
+    '''
+    SubFile closing its underlying stream when it is closed
+    '''
+    def close(self):
+        if not self.stream.closed:
+            SubFile.close(self)
+            self.stream.close()
+
+class CatalogEntry(object):
+    '''
+    A resource found by Catalog.query
+    '''
+    __slots__ = ("archive", "inner_path", "typecode", "resid", "flags", "name", "offset", "size")
+
+    def __init__(self, archive, inner_path, typecode, resid, flags, name, offset, size):
+        self.archive = archive          #path of the physical file
+        self.inner_path = inner_path    #path of the IFF file inside the FAR archive, '' for loose IFF files
+        self.typecode = typecode
+        self.resid = resid
+        self.flags = flags
+        self.name = name
+        self.offset = offset            #absolute offset of the resource header in the physical file
+        self.size = size                #size of the resource including header
+
+    def open(self, stream=None):
+        '''
+        @param stream open stream of the physical file. If None, the file is opened
+                      and closed again when the returned stream is closed
+        @return file-like object accessing resource data (including resource header), like IffFile.open
+        '''
+        if stream is None:
+            return _OwningSubFile(open(self.archive, "rb"), self.offset, self.size)
+        return SubFile(stream, self.offset, self.size)
+
+    def __repr__(self):
+        return "CatalogEntry(%r, %r, %r, %r, %r, %r, %r, %r)" % (self.archive, self.inner_path, self.typecode,
+                                                                 self.resid, self.flags, self.name, self.offset, self.size)
+
+class Catalog(object):
+    '''
+    SQLite resource catalog, see module documentation
+    '''
+    def __init__(self, database_path):
+        '''
+        @param database_path filename of the SQLite database, created if it does not exist
+        '''
+        self.db = sqlite3.connect(database_path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(_schema)
+
+    def build(self, root, max_workers=None):
+        '''
+        Indexes all FAR and IFF files below root. Files which are unchanged since the last
+        build (same size and modification time) are skipped, rows of files which have
+        been removed are deleted. Files which could not be read are not recorded, so
+        they are tried again by the next build.
+
+        @param max_workers number of processes, see concurrent.futures.ProcessPoolExecutor
+        @return dict with the numbers of indexed, skipped and removed files and a dict
+                errors mapping paths to error messages for files which could not be read
+        '''
+        root = os.path.abspath(root)
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(archive_suffixes):
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    found[path] = (stat.st_mtime_ns, stat.st_size)
+
+        known = dict((path, (archive_id, mtime_ns, size)) for archive_id, path, mtime_ns, size in
+                     self.db.execute("SELECT id, path, mtime_ns, size FROM archives WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                                     (root, _like_prefix(root + os.sep))))
+        stats = {"indexed": 0, "skipped": 0, "removed": 0, "errors": {}}
+        with self.db:
+            for path, (archive_id, mtime_ns, size) in known.items():
+                if path not in found:
+                    self.db.execute("DELETE FROM archives WHERE id = ?", (archive_id,))
+                    stats["removed"] += 1
+
+        todo = [path for path, stat in sorted(found.items()) if path not in known or known[path][1:] != stat]
+        stats["skipped"] = len(found) - len(todo)
+        if not todo:
+            return stats
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for path, rows, error in executor.map(_index_file, todo, chunksize=4):
+                mtime_ns, size = found[path]
+                with self.db:
+                    self.db.execute("DELETE FROM archives WHERE path = ?", (path,))
+                    if error is not None:
+                        stats["errors"][path] = error
+                        continue
+                    archive_id = self.db.execute("INSERT INTO archives (path, mtime_ns, size) VALUES (?, ?, ?)",
+                                                 (path, mtime_ns, size)).lastrowid
+                    self.db.executemany("INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        ((archive_id,) + row for row in rows))
+                stats["indexed"] += 1
+        return stats
+
+    def query(self, query, archive=None):
+        '''
+        @param query iff.ResourceQuery. The name pattern is matched using SQLite's GLOB,
+                     which behaves like fnmatch.fnmatchcase for the usual patterns
+        @param archive if given, shell-style pattern for the path of the physical file
+        @return list of CatalogEntry objects ordered by archive, inner path and offset
+        '''
+        conditions = []
+        params = []
+        if query.typecode is not None:
+            conditions.append("r.typecode = ?")
+            params.append(query.typecode)
+        if isinstance(query.resid, range):
+            conditions.append("r.resid >= ? AND r.resid < ?" if query.resid.step > 0 else "r.resid <= ? AND r.resid > ?")
+            params.extend((query.resid.start, query.resid.stop))
+            if abs(query.resid.step) != 1:
+                conditions.append("(r.resid - ?) % ? = 0")
+                params.extend((query.resid.start, query.resid.step))
+        elif query.resid is not None:
+            conditions.append("r.resid = ?")
+            params.append(query.resid)
+        if query.flags_mask or query.flags:
+            conditions.append("(r.flags & ?) = ?")
+            params.extend((query.flags_mask, query.flags))
+        if query.name is not None:
+            conditions.append("r.name GLOB ?")
+            params.append(query.name)
+        if archive is not None:
+            conditions.append("a.path GLOB ?")
+            params.append(archive)
+        sql = ("SELECT a.path, r.inner_path, r.typecode, r.resid, r.flags, r.name, r.offset, r.size "
+               "FROM resources r JOIN archives a ON a.id = r.archive_id")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY a.path, r.inner_path, r.offset"
+        return [CatalogEntry(*row) for row in self.db.execute(sql, params)]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _like_prefix(prefix):
+    '''
+    @return LIKE pattern matching all strings starting with prefix (escape character '\\')
+    '''
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+#Testcode
+
+from .gamedata_for_tests import requires_known_iff_file, make_far_file, make_iff_file
+from .iff import read_resource_header_from_stream
+import tempfile
+
+try:
+    from nose.tools import assert_raises
+
+    @requires_known_iff_file
+    def test_catalog(known_iff_file):
+        root = os.path.dirname(known_iff_file.filename)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with Catalog(os.path.join(tmpdir, "catalog.db")) as catalog:
+                stats = catalog.build(root, max_workers=2)
+                assert stats["indexed"] > 0 and not stats["errors"]
+                entries = catalog.query(ResourceQuery("BHAV", 4100), archive="*User00000.iff")
+                assert len(entries) == 1
+                with entries[0].open() as stream:
+                    header = read_resource_header_from_stream(stream)
+                    assert (header.typecode, header.resid, header.name) == ("BHAV", 4100, "init traits")
+                thumbnails = catalog.query(ResourceQuery("BMP_", name="thumb*"))
+                assert os.path.abspath(known_iff_file.filename) in set(entry.archive for entry in thumbnails)
+                assert catalog.build(root)["indexed"] == 0
+
+    def test_catalog_of_synthetic_files():
+        objects = make_iff_file([("OBJD", 128, 16, "chair", b"o"*20), ("BHAV", 4096, 16, "Main", b"b"*30)])
+        person = make_iff_file([("BHAV", 4096, 16, "Main", b"p"*10), ("GLOB", 128, 0, "Semi-global file", b"\x0dPersonGlobals")], 1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, "GameData"))
+            far_path = os.path.join(tmpdir, "GameData", "Objects.far")
+            with open(far_path, "wb") as f:
+                f.write(make_far_file([("chair.iff", objects), ("readme.txt", b"no iff"), ("People\\person.iff", person)]))
+            with open(os.path.join(tmpdir, "loose.iff"), "wb") as f:
+                f.write(objects)
+            bad_path = os.path.join(tmpdir, "bad.iff")
+            with open(bad_path, "wb") as f:
+                f.write(b"garbage"*20)
+            with Catalog(os.path.join(tmpdir, "catalog.db")) as catalog:
+                stats = catalog.build(tmpdir, max_workers=2)
+                assert stats["indexed"] == 2 and list(stats["errors"]) == [bad_path]
+                entries = catalog.query(ResourceQuery("BHAV", 4096))
+                assert [(os.path.basename(entry.archive), entry.inner_path) for entry in entries] == [
+                    ("Objects.far", "People\\person.iff"), ("Objects.far", "chair.iff"), ("loose.iff", "")]
+                with open(far_path, "rb") as stream:
+                    with entries[0].open(stream) as resfile:
+                        assert resfile.read()[76:] == b"p"*10
+                assert len(catalog.query(ResourceQuery(name="Semi*"), archive="*.far")) == 1
+                #the broken file is not recorded and tried again
+                stats = catalog.build(tmpdir)
+                assert (stats["indexed"], stats["skipped"], list(stats["errors"])) == (0, 2, [bad_path])
+                os.remove(bad_path)
+                os.remove(os.path.join(tmpdir, "loose.iff"))
+                stats = catalog.build(tmpdir)
+                assert (stats["removed"], stats["errors"]) == (1, {})
+                assert len(catalog.query(ResourceQuery())) == 6 #including the two resource maps
+
+    def test_catalog_reports_unreadable_far_manifest():
+        objects = make_iff_file([("BHAV", 4096, 16, "Main", b"b"*30)])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "Objects.far"), "wb") as f:
+                f.write(make_far_file([("chair.iff", objects)]))
+            broken_path = os.path.join(tmpdir, "Broken.far")
+            with open(broken_path, "wb") as f:
+                f.write(make_far_file([("chair.iff", objects)]).replace(b"chair.iff", b"ch\xe4ir.iff"))
+            with Catalog(os.path.join(tmpdir, "catalog.db")) as catalog:
+                stats = catalog.build(tmpdir, max_workers=2)
+                assert stats["indexed"] == 1 and list(stats["errors"]) == [broken_path]
+                assert len(catalog.query(ResourceQuery("BHAV", 4096))) == 1
+
+except ImportError:
+    pass
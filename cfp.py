@@ -26,6 +26,8 @@ http://simtech.sourceforge.net/tech/cfp-research.html
 import struct
 import math
 
+from . import instrumentation
+
 def read_compressed_floats(stream, num):
     dta = [None]*num
     last_value = None
@@ -51,6 +53,7 @@ def read_compressed_floats(stream, num):
     assert count_read == num #sanity check
     return dta
 
+@instrumentation.timed("cfp.read_animdta")
 def read_animdta_from_cfp_stream(stream, num_px, num_py, num_pz, num_rw, num_rx, num_ry, num_rz):
     '''
     @param stream file-like object
@@ -35,9 +35,18 @@ http://www.donhopkins.com/drupal/node/21
 for additional details of the sceleton description in The Sims™
 '''
 
-from .datastream import TextDataStream, BinaryDataStream
+from .datastream import TextDataStream, TokenizedTextDataStream, BinaryDataStream
+from . import instrumentation
 
+import io
 import struct
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class simplereprobject(object):
     '''
@@ -138,12 +147,141 @@ class CharacterData(simplereprobject):
             self.censor_flag = censor_flag  # is this a real skin or a bounding box used to draw the pixelation over a nude character?
             self.props = props #assuming here, that unknown integer describes property list
 
-def read_characterdata_from_stream(stream):
+class CompactSceleton(object):
+    '''
+    Sceleton with the bone properties stored in NumPy arrays (requires NumPy)
+
+    The bones are in topological order, i.e. every bone comes after its parent,
+    so transformations can be accumulated in a single pass over the bones.
+    Parents are given by index (-1 for root bones) instead of by name.
+    '''
+    def __init__(self, name, names, parents, positions, quats, flags, wiggles, props, root_parent_names):
+        self.name = name
+        self.names = names                          # list of bone names
+        self.indices = dict((bone_name, index) for index, bone_name in enumerate(names)) # bone name -> index
+        self.parents = parents                      # int32 array (n,) of parent indices, -1 for root bones
+        self.positions = positions                  # float32 array (n,3), see Bone.pos
+        self.quats = quats                          # float32 array (n,4) [w,x,y,z], see Bone.quat
+        self.flags = flags                          # int32 array (n,3) with can_trans, can_rot, suits_can_blend
+        self.wiggles = wiggles                      # float32 array (n,2) with wiggle_value, wiggle_power
+        self.props = props                          # list of property lists
+        self.root_parent_names = root_parent_names  # index of root bone -> its parent_name (which is no bone name)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_bones(cls, name, bones):
+        '''
+        @param bones list of Bone objects in any order
+        '''
+        if numpy is None:
+            raise ImportError("CompactSceleton requires NumPy")
+        by_name = dict((bone.name, bone) for bone in bones)
+        if len(by_name) != len(bones):
+            raise ValueError("Duplicate bone names in sceleton %r" % name)
+        #depth-first, keeps the original order if it is already topological
+        ordered = []
+        state = {} #bone name -> False while visiting, True when placed
+        for bone in bones:
+            path = []
+            while bone is not None and bone.name not in state:
+                state[bone.name] = False
+                path.append(bone)
+                bone = by_name.get(bone.parent_name)
+            if bone is not None and not state[bone.name]:
+                raise ValueError("Cyclic bone hierarchy at bone %r" % bone.name)
+            for bone in reversed(path):
+                state[bone.name] = True
+                ordered.append(bone)
+
+        names = [bone.name for bone in ordered]
+        indices = dict((bone_name, index) for index, bone_name in enumerate(names))
+        parents = numpy.array([indices.get(bone.parent_name, -1) for bone in ordered], dtype=numpy.int32)
+        root_parent_names = dict((index, bone.parent_name) for index, bone in enumerate(ordered) if parents[index] == -1)
+        return cls(name, names, parents,
+                   numpy.array([bone.pos for bone in ordered], dtype=numpy.float32).reshape(-1, 3),
+                   numpy.array([bone.quat for bone in ordered], dtype=numpy.float32).reshape(-1, 4),
+                   numpy.array([(bone.can_trans, bone.can_rot, bone.suits_can_blend) for bone in ordered], dtype=numpy.int32).reshape(-1, 3),
+                   numpy.array([(bone.wiggle_value, bone.wiggle_power) for bone in ordered], dtype=numpy.float32).reshape(-1, 2),
+                   [bone.props for bone in ordered], root_parent_names)
+
+    @classmethod
+    def from_sceleton(cls, sceleton):
+        return cls.from_bones(sceleton.name, sceleton.bones)
+
+    def to_bones(self):
+        '''
+        @return list of Bone objects in topological order. Values read from
+                cmx files may have lost precision by the conversion to float32
+        '''
+        bones = []
+        for index, (parent, pos, quat, flags, wiggle) in enumerate(zip(self.parents.tolist(), self.positions.tolist(),
+                                                                      self.quats.tolist(), self.flags.tolist(), self.wiggles.tolist())):
+            parent_name = self.root_parent_names[index] if parent == -1 else self.names[parent]
+            bones.append(CharacterData.Bone(self.names[index], parent_name, self.props[index], tuple(pos), tuple(quat),
+                                            flags[0], flags[1], flags[2], wiggle[0], wiggle[1]))
+        return bones
+
+    def to_sceleton(self):
+        return CharacterData.Sceleton(self.name, self.to_bones())
+
+def read_characterdata_from_stream(stream, lazy=False):
     '''
     @arg stream file-like object
+    @arg lazy see read_characterdata_from_buffer. If True, bcf data is read at once
 
     This routine automatically determines whether this is a cmx stream (text) or a bcf stream
     '''
+    #We don't know yet if the stream contains cmx or bcf data. And because
+    #we don't want to impose the requirement that the stream is random-access,
+    #we will now read the first 4 bytes. Cmx file always start with 2 lines
+    #   // Character File. Copyright 1997, Maxis Inc.
+    #   version 300
+    first4bytes = stream.read(4)
+    if first4bytes ==  b'// C':
+        #TextStream
+        stream = TokenizedTextDataStream(stream, skip_lines=2, seq_delim='|')
+        num_sceletons = stream.read_int()
+    elif lazy:
+        return _read_characterdata_from_bcf_buffer(first4bytes + stream.read(), lazy)
+    else:
+        #BinaryStream
+        stream = BinaryDataStream(stream)
+        num_sceletons = struct.unpack("<I", first4bytes)[0]
+    return _read_characterdata(stream, num_sceletons)
+
+def read_characterdata_from_buffer(buf, lazy=False, max_cached_skills=16):
+    '''
+    Fast path for data which has been read at once or is mapped into memory:
+    bcf data is parsed in place with precompiled structs instead of issuing
+    a read per number or string. Returns the same as read_characterdata_from_stream.
+
+    @arg buf bytes, bytearray, memoryview or mmap object containing a cmx or bcf file
+    @arg lazy if True, the skills of bcf data are not decoded but only located, and
+              the CharacterData gets a LazySkillList decoding each skill when it is
+              accessed. buf has to stay valid as long as the skills are used.
+              cmx data is always decoded completely
+    @arg max_cached_skills see LazySkillList
+    '''
+    if bytes(buf[:4]) == b'// C':
+        #cmx files are parsed line by line anyway
+        return read_characterdata_from_stream(io.BytesIO(buf))
+    return _read_characterdata_from_bcf_buffer(buf, lazy, max_cached_skills)
+
+def read_characterdata_from_datastream(stream):
+    '''
+    @arg stream DataStream (see datastream.py) positioned at the start of the character data
+                (for cmx files behind the 2 header lines)
+    '''
+    return _read_characterdata(stream, stream.read_int())
+
+@instrumentation.timed("bcf.read_characterdata")
+def _read_characterdata(stream, num_sceletons):
+    '''
+    @param stream DataStream
+    @param num_sceletons first number of the character data, already read by the caller
+    '''
     def read_sublist(stream):
         '''
         @arg stream DataStream
@@ -198,21 +336,6 @@ def read_characterdata_from_stream(stream):
             bones.append(read_bone(stream))
         return CharacterData.Sceleton(name, bones)
 
-    #We don't know yet if the stream contains cmx or bcf data. And because
-    #we don't want to impose the requirement that the stream is random-access,
-    #we will now read the first 4 bytes. Cmx file always start with 2 lines
-    #   // Character File. Copyright 1997, Maxis Inc.
-    #   version 300
-    first4bytes = stream.read(4)
-    if first4bytes ==  b'// C':
-        #TextStream
-        stream = TextDataStream(stream, skip_lines=2, seq_delim='|')
-        num_sceletons = stream.read_int()
-    else:
-        #BinaryStream
-        stream = BinaryDataStream(stream)
-        num_sceletons = struct.unpack("<I", first4bytes)[0]
-
     #Sceletons
     assert num_sceletons < 100 #sanity check (if this is not a cmx file, we will proprably get something absurd here)
     sceletons = []
@@ -335,6 +458,230 @@ def read_characterdata_from_stream(stream):
 
     return CharacterData(sceletons, suits, skills)
 
+#Fast path for bcf data in a buffer, see read_characterdata_from_buffer.
+#Every reader gets the buffer and an offset and returns the parsed object together
+#with the offset behind it. Runs of fixed size fields are unpacked at once.
+_uint32_struct = struct.Struct("<I")
+_bone_struct   = struct.Struct("<7f3I2f") #pos, quat, can_trans, can_rot, can_blend, wiggle_value, wiggle_power
+_skill_struct  = struct.Struct("<2f4I")   #duration, distance, move_flag, num_pos, num_rot, num_motions
+_motion_struct = struct.Struct("<If4I")   #num_frames, duration, pos_used, rot_used, pos_off, rot_off
+
+def _read_bcf_uint32(buf, pos):
+    return _uint32_struct.unpack_from(buf, pos)[0], pos + 4
+
+def _skip_bcf_str(buf, pos):
+    '''
+    @return offset behind the pascal-style string at pos
+    @raise struct.error if the string exceeds the buffer (like the stream path does)
+    '''
+    if pos >= len(buf):
+        raise struct.error("unpack requires a buffer of 1 bytes")
+    end = pos + 1 + buf[pos]
+    if end > len(buf):
+        raise struct.error("unpack requires a buffer of %d bytes" % (end - pos - 1))
+    return end
+
+def _read_bcf_str(buf, pos):
+    end = _skip_bcf_str(buf, pos)
+    return str(buf[pos+1:end], "ascii"), end
+
+def _read_bcf_list(buf, pos, read_item):
+    '''
+    @return list of items preceded by their number
+    '''
+    num = _uint32_struct.unpack_from(buf, pos)[0]
+    pos += 4
+    if num == 0: #most property lists are empty
+        return [], pos
+    items = []
+    for i in range(num):
+        item, pos = read_item(buf, pos)
+        items.append(item)
+    return items, pos
+
+def _read_bcf_prop(buf, pos):
+    prop_name, pos = _read_bcf_str(buf, pos)
+    prop_value, pos = _read_bcf_str(buf, pos)
+    return (prop_name, prop_value), pos
+
+def _read_bcf_sublist(buf, pos):
+    return _read_bcf_list(buf, pos, _read_bcf_prop)
+
+def _read_bcf_proplist(buf, pos):
+    return _read_bcf_list(buf, pos, _read_bcf_sublist)
+
+def _read_bcf_bone(buf, pos):
+    name, pos = _read_bcf_str(buf, pos)
+    parent_name, pos = _read_bcf_str(buf, pos)
+    props, pos = _read_bcf_proplist(buf, pos)
+    values = _bone_struct.unpack_from(buf, pos)
+    return CharacterData.Bone(name, parent_name, props, values[0:3], values[3:7], *values[7:]), pos + _bone_struct.size
+
+def _read_bcf_sceleton(buf, pos):
+    name, pos = _read_bcf_str(buf, pos)
+    bones, pos = _read_bcf_list(buf, pos, _read_bcf_bone)
+    return CharacterData.Sceleton(name, bones), pos
+
+def _read_bcf_skin(buf, pos):
+    bone_name, pos = _read_bcf_str(buf, pos)
+    skin_name, pos = _read_bcf_str(buf, pos)
+    censor_flag, pos = _read_bcf_uint32(buf, pos)
+    props, pos = _read_bcf_proplist(buf, pos)
+    return CharacterData.Skin(bone_name, skin_name, censor_flag, props), pos
+
+def _read_bcf_suit(buf, pos):
+    name, pos = _read_bcf_str(buf, pos)
+    stype, pos = _read_bcf_uint32(buf, pos)
+    props, pos = _read_bcf_proplist(buf, pos)
+    skins, pos = _read_bcf_list(buf, pos, _read_bcf_skin)
+    return CharacterData.Suit(name, stype, skins, props), pos
+
+def _read_bcf_moment(buf, pos):
+    time, pos = _read_bcf_uint32(buf, pos)
+    events, pos = _read_bcf_sublist(buf, pos)
+    return (time, events), pos
+
+def _read_bcf_timeline(buf, pos):
+    return _read_bcf_list(buf, pos, _read_bcf_moment)
+
+def _read_bcf_motion(buf, pos):
+    bone_name, pos = _read_bcf_str(buf, pos)
+    num_frames, duration, pos_used, rot_used, pos_off, rot_off = _motion_struct.unpack_from(buf, pos)
+    props, pos = _read_bcf_proplist(buf, pos + _motion_struct.size)
+    timelines, pos = _read_bcf_list(buf, pos, _read_bcf_timeline)
+    return CharacterData.Motion(bone_name, num_frames, duration, pos_used != 0, rot_used != 0, pos_off, rot_off, props, timelines), pos
+
+def _read_bcf_skill(buf, pos):
+    skill_name, pos = _read_bcf_str(buf, pos)
+    ani_name, pos = _read_bcf_str(buf, pos)
+    duration, distance, move_flag, num_pos, num_rot, num_motions = _skill_struct.unpack_from(buf, pos)
+    pos += _skill_struct.size
+    motions = []
+    for i in range(num_motions):
+        motion, pos = _read_bcf_motion(buf, pos)
+        motions.append(motion)
+    return CharacterData.Skill(skill_name, ani_name, duration, distance, move_flag, num_pos, num_rot, motions), pos
+
+#Lazy decoding of skills: _scan_bcf_skill only walks over a skill (without
+#creating any objects) to find where the next one starts
+def _skip_bcf_sublist(buf, pos):
+    num_props = _uint32_struct.unpack_from(buf, pos)[0]
+    pos += 4
+    for i in range(2*num_props):
+        pos = _skip_bcf_str(buf, pos)
+    return pos
+
+def _skip_bcf_proplist(buf, pos):
+    num_sublists = _uint32_struct.unpack_from(buf, pos)[0]
+    pos += 4
+    for i in range(num_sublists):
+        pos = _skip_bcf_sublist(buf, pos)
+    return pos
+
+def _skip_bcf_motion(buf, pos):
+    pos = _skip_bcf_str(buf, pos) + _motion_struct.size #bone_name and fixed size fields
+    pos = _skip_bcf_proplist(buf, pos)
+    num_timelines = _uint32_struct.unpack_from(buf, pos)[0]
+    pos += 4
+    for i in range(num_timelines):
+        num_moments = _uint32_struct.unpack_from(buf, pos)[0]
+        pos += 4
+        for j in range(num_moments):
+            pos = _skip_bcf_sublist(buf, pos + 4)
+    return pos
+
+def _scan_bcf_skill(buf, pos):
+    '''
+    @return tuple (name of the skill, offset behind the skill)
+    '''
+    skill_name, pos = _read_bcf_str(buf, pos)
+    pos = _skip_bcf_str(buf, pos) #ani_name
+    num_motions = _skill_struct.unpack_from(buf, pos)[-1]
+    pos += _skill_struct.size
+    for i in range(num_motions):
+        pos = _skip_bcf_motion(buf, pos)
+    return skill_name, pos
+
+class LazySkillList(object):
+    '''
+    Skills of bcf data read with lazy=True, see read_characterdata_from_buffer
+
+    Can be used like the list of Skill objects of a completely decoded
+    CharacterData, but a skill is only decoded when it is accessed. The
+    max_cached most recently accessed skills are kept.
+    '''
+    def __init__(self, buf, offsets, names, max_cached=16):
+        '''
+        @param offsets offsets of the skills in buf
+        @param names names of the skills
+        '''
+        self.buf = buf
+        self.offsets = offsets
+        self.names = names
+        self.indices = {} #name -> index of first skill with this name
+        for index, name in enumerate(names):
+            self.indices.setdefault(name, index)
+        self.max_cached = max_cached
+        self.cache = OrderedDict() #index -> Skill, least recently used first
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("skill index out of range")
+        skill = self.cache.get(index)
+        if skill is not None:
+            self.cache.move_to_end(index)
+            return skill
+        skill = _read_bcf_skill(self.buf, self.offsets[index])[0]
+        self.cache[index] = skill
+        if len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return skill
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get(self, name, default=None):
+        '''
+        @return the skill named name or default if there is none
+        '''
+        index = self.indices.get(name)
+        if index is None:
+            return default
+        return self[index]
+
+    def __repr__(self):
+        return "LazySkillList(%r)" % self.names
+
+@instrumentation.timed("bcf.read_characterdata")
+def _read_characterdata_from_bcf_buffer(buf, lazy=False, max_cached_skills=16):
+    num_sceletons = _uint32_struct.unpack_from(buf, 0)[0]
+    assert num_sceletons < 100 #sanity check, see _read_characterdata
+    sceletons, pos = _read_bcf_list(buf, 0, _read_bcf_sceleton)
+    suits, pos = _read_bcf_list(buf, pos, _read_bcf_suit)
+    if not lazy:
+        skills, pos = _read_bcf_list(buf, pos, _read_bcf_skill)
+        return CharacterData(sceletons, suits, skills)
+
+    num_skills = _uint32_struct.unpack_from(buf, pos)[0]
+    pos += 4
+    offsets = array("I")
+    names = []
+    for i in range(num_skills):
+        offsets.append(pos)
+        name, pos = _scan_bcf_skill(buf, pos)
+        names.append(name)
+    if pos > len(buf):
+        raise struct.error("unpack requires a buffer of %d bytes" % pos)
+    return CharacterData(sceletons, suits, LazySkillList(buf, offsets, names, max_cached_skills))
+
 #Command-line utility
 if __name__ == "__main__":
     import sys
@@ -356,6 +703,21 @@ if __name__ == "__main__":
         for skill in cdta.skills:
             print("  " + skill.name)
 
+    def do_bench(args):
+        import timeit
+        import tempfile
+        from .subfile import SubFile
+        #parse from a file like from an archive, i.e. through a SubFile
+        tmpfile = tempfile.TemporaryFile()
+        length = tmpfile.write(args.instream.read())
+        paths = [("stream", lambda: read_characterdata_from_stream(SubFile(tmpfile, 0, length))),
+                 ("buffer", lambda: read_characterdata_from_buffer(SubFile(tmpfile, 0, length).read()))]
+        seconds = {}
+        for name, func in paths:
+            seconds[name] = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+            print("%s: %.1f ms per file" % (name, seconds[name]*1000))
+        print("speedup: %.1fx" % (seconds["stream"] / seconds["buffer"]))
+
     import argparse
 
     parser = argparse.ArgumentParser(prog='far')
@@ -364,6 +726,10 @@ if __name__ == "__main__":
     parser_list = subparsers.add_parser('list', help='list data in cmx/bcf file (expected from stdin)')
     parser_list.set_defaults(func=do_list)
 
+    parser_bench = subparsers.add_parser('bench', help='compare parsing a cmx/bcf file (expected from stdin) from a stream and from a buffer')
+    parser_bench.add_argument('-n', '--number', type=int, default=10, help='number of parses per measurement')
+    parser_bench.set_defaults(func=do_bench)
+
     args = parser.parse_args()
 
     #We do not require random-access to input stream here,
@@ -388,3 +754,106 @@ def test_read_female_wizard_cmx():
     assert pprint(chardta.suits)     == pprint(known_file.suits)
     assert pprint(chardta.skills)    == pprint(known_file.skills)
 
+
+def test_compact_sceleton():
+    if numpy is None:
+        return
+    def bone(name, parent_name, x):
+        return CharacterData.Bone(name, parent_name, [], (x, 0.5, 0.0), (1.0, 0.0, 0.0, 0.0), 1, 1, 0, 0.0, 0.25)
+    bones = [bone("HEAD", "NECK", 3.0), bone("ROOT", "NULL", 0.0), bone("NECK", "PELVIS", 2.0), bone("PELVIS", "ROOT", 1.0)]
+    sceleton = CompactSceleton.from_sceleton(CharacterData.Sceleton("adult", bones))
+    assert sceleton.names == ["ROOT", "PELVIS", "NECK", "HEAD"]
+    assert sceleton.parents.tolist() == [-1, 0, 1, 2] and sceleton.parents.dtype == numpy.int32
+    assert sceleton.positions.shape == (4, 3) and sceleton.quats.shape == (4, 4)
+    assert sceleton.positions[sceleton.indices["HEAD"]].tolist() == [3.0, 0.5, 0.0]
+    by_name = dict((b.name, b) for b in bones)
+    assert [repr(b) for b in sceleton.to_bones()] == [repr(by_name[name]) for name in sceleton.names]
+    try:
+        CompactSceleton.from_bones("cyclic", [bone("A", "B", 0.0), bone("B", "A", 0.0)])
+        assert False
+    except ValueError:
+        pass
+
+def test_truncated_bcf_buffer():
+    def bcf_str(s):
+        return bytes([len(s)]) + s
+    motion = bcf_str(b"PELVIS") + _motion_struct.pack(2, 0.5, 1, 0, 0, 0) \
+        + struct.pack("<I", 1) + struct.pack("<I", 1) + bcf_str(b"key") + bcf_str(b"value") \
+        + struct.pack("<II", 1, 1) + struct.pack("<II", 10, 1) + bcf_str(b"xevt") + bcf_str(b"1")
+    skill = bcf_str(b"a2o-standing") + bcf_str(b"a2o-standing-anim") + _skill_struct.pack(1.0, 0.0, 0, 2, 0, 1) + motion
+    buf = struct.pack("<3I", 0, 0, 1) + skill
+    cdta = read_characterdata_from_buffer(buf)
+    lazy_cdta = read_characterdata_from_buffer(buf, lazy=True)
+    assert repr(lazy_cdta.skills[0]) == repr(cdta.skills[0])
+    assert cdta.skills[0].motions[0].props == [[("key", "value")]]
+    #Every truncation is reported as struct.error, whether it is found while
+    #decoding, while scanning lazily or when a lazy skill is accessed
+    for length in range(len(buf)):
+        truncated = buf[:length]
+        for lazy in (False, True):
+            try:
+                read_characterdata_from_buffer(truncated, lazy).skills[0]
+                assert False, (length, lazy)
+            except struct.error:
+                pass
+
+def test_bcf_round_trip():
+    def bcf_str(s):
+        return bytes([len(s)]) + s
+    def bcf_sublist(props):
+        return struct.pack("<I", len(props)) + b"".join(bcf_str(name) + bcf_str(value) for name, value in props)
+    def bcf_proplist(sublists):
+        return struct.pack("<I", len(sublists)) + b"".join(bcf_sublist(props) for props in sublists)
+    def bcf_bone(name, parent_name, props, x):
+        return bcf_str(name) + bcf_str(parent_name) + bcf_proplist(props) \
+            + _bone_struct.pack(x, 0.5, -1.25, 1.0, 0.0, 0.0, 0.0, 1, 1, 0, 0.0, 0.25)
+    def bcf_motion(bone_name, props, timelines):
+        return bcf_str(bone_name) + _motion_struct.pack(4, 0.75, 1, 0, 12, 0) + bcf_proplist(props) \
+            + struct.pack("<I", len(timelines)) + b"".join(struct.pack("<I", len(moments)) \
+                + b"".join(struct.pack("<I", time) + bcf_sublist(events) for time, events in moments) for moments in timelines)
+    def bcf_skill(name, motions):
+        return bcf_str(name) + bcf_str(name + b"-anim") + _skill_struct.pack(1.5, 2.0, 1, 8, 4, len(motions)) + b"".join(motions)
+    bones = [bcf_bone(b"ROOT", b"NULL", [], 0.0), bcf_bone(b"PELVIS", b"ROOT", [[(b"gender", b"female")]], 1.0)]
+    sceleton = bcf_str(b"adult") + struct.pack("<I", len(bones)) + b"".join(bones)
+    skin = bcf_str(b"PELVIS") + bcf_str(b"xskin-b001fafit_01-PELVIS-BODY") + struct.pack("<I", 1) + bcf_proplist([[(b"censor", b"1")]])
+    suit = bcf_str(b"b001fafit_01") + struct.pack("<I", 0) + bcf_proplist([]) + struct.pack("<I", 1) + skin
+    skills = [bcf_skill(b"a2o-standing", [bcf_motion(b"PELVIS", [[(b"key", b"value")]], [[(10, [(b"xevt", b"1")]), (20, [])]])]),
+              bcf_skill(b"a2o-walk", [bcf_motion(b"ROOT", [], []), bcf_motion(b"PELVIS", [], [[]])]),
+              bcf_skill(b"a2o-idle", [])]
+    buf = struct.pack("<I", 1) + sceleton + struct.pack("<I", 1) + suit + struct.pack("<I", len(skills)) + b"".join(skills)
+
+    def as_repr(cdta):
+        return repr(cdta.sceletons), repr(cdta.suits), [repr(skill) for skill in cdta.skills]
+    expected = as_repr(read_characterdata_from_buffer(buf))
+    assert as_repr(read_characterdata_from_buffer(buf, lazy=True, max_cached_skills=1)) == expected
+    assert as_repr(read_characterdata_from_stream(io.BytesIO(buf))) == expected
+    assert as_repr(read_characterdata_from_stream(io.BytesIO(buf), lazy=True)) == expected
+    assert as_repr(read_characterdata_from_datastream(BinaryDataStream(io.BytesIO(buf)))) == expected
+
+    cdta = read_characterdata_from_stream(io.BytesIO(buf))
+    assert [bone.name for bone in cdta.sceletons[0].bones] == ["ROOT", "PELVIS"]
+    assert cdta.sceletons[0].bones[1].pos == (1.0, 0.5, -1.25) and cdta.sceletons[0].bones[1].props == [[("gender", "female")]]
+    assert cdta.suits[0].skins[0].skin_name == "xskin-b001fafit_01-PELVIS-BODY"
+    assert [skill.name for skill in cdta.skills] == ["a2o-standing", "a2o-walk", "a2o-idle"]
+    assert cdta.skills[0].motions[0].timelines == [[(10, [("xevt", "1")]), (20, [])]]
+    lazy_skills = read_characterdata_from_buffer(buf, lazy=True).skills
+    assert repr(lazy_skills.get("a2o-walk")) == repr(cdta.skills[1]) and lazy_skills.get("a2o-run") is None
+
+def test_read_cmx_text():
+    lines = ["// Character File. Copyright 1997, Maxis Inc.", "version 300",
+             "1", "adult", "1", "PELVIS", "NULL", "0", "| 0.1 -0.2 0.3 |", "| 1 0 0 0 |", "1", "1", "0", "0.1", "0.25",
+             "1", "b001fafit_01", "0", "0", "1", "PELVIS", "xskin-b001fafit_01-PELVIS-BODY", "0", "0",
+             "1", "a2o-standing", "a2o-standing-anim", "1.5", "0.3", "1", "8", "4", "1",
+             "PELVIS", "4", "0.75", "1", "0", "-1", "0", "1", "1", "key", "value", "1", "1", "10", "1", "xevt", "1"]
+    cmx = ("\r\n".join(lines) + "\r\n").encode("ascii")
+    cdta = read_characterdata_from_stream(io.BytesIO(cmx))
+    bone = cdta.sceletons[0].bones[0]
+    assert (bone.name, bone.pos, bone.quat, bone.wiggle_value) == ("PELVIS", (0.1, -0.2, 0.3), (1.0, 0.0, 0.0, 0.0), 0.1)
+    assert cdta.suits[0].skins[0].skin_name == "xskin-b001fafit_01-PELVIS-BODY"
+    skill = cdta.skills[0]
+    assert (skill.name, skill.duration, skill.distance, skill.num_pos, skill.num_rot) == ("a2o-standing", 1.5, 0.3, 8, 4)
+    motion = skill.motions[0]
+    assert (motion.pos_used, motion.rot_used, motion.pos_off, motion.props) == (True, False, -1, [[("key", "value")]])
+    assert motion.timelines == [[(10, [("xevt", "1")])]]
+    #the tokenized stream used by read_characterdata_from_stream gives the same result as TextDataStream
+    assert repr(read_characterdata_from_datastream(TextDataStream(io.BytesIO(cmx), skip_lines=2, seq_delim="|"))) == repr(cdta)
@@ -32,7 +32,23 @@ purpose we introduce two classes in this file:
 
 from .fileiocommon import read_pascal_style_string, read_zero_zerminated_string
 
+from array import array
 import struct
+import sys
+
+_structs = {} #format -> struct.Struct
+
+def _struct(fmt):
+    '''
+    @return precompiled struct.Struct for fmt, created on first use
+    '''
+    compiled = _structs.get(fmt)
+    if compiled is None:
+        compiled = _structs[fmt] = struct.Struct(fmt)
+    return compiled
+
+_int_struct = _struct("<I")
+_float_struct = _struct("<f")
 
 class BinaryDataStream(object):
     '''
@@ -42,20 +58,53 @@ class BinaryDataStream(object):
         self.stream = bytestream
 
     def read_int(self):
-        return struct.unpack("<I", self.stream.read(4))[0]
+        return _int_struct.unpack(self.stream.read(4))[0]
 
     def read_ints(self, num):
-        return struct.unpack("<" + "".join(["I"]*num), self.stream.read(4*num))
+        return _struct("<%dI" % num).unpack(self.stream.read(4*num))
 
     def read_float(self):
-        return struct.unpack("<f", self.stream.read(4))[0]
+        return _float_struct.unpack(self.stream.read(4))[0]
 
     def read_floats(self, num):
-        return struct.unpack("<" + "".join(["f"]*num), self.stream.read(4*num))
+        return _struct("<%df" % num).unpack(self.stream.read(4*num))
 
     def read_str(self):
         return read_pascal_style_string(self.stream).decode("ascii")
 
+    def read_array(self, typecode, num):
+        '''
+        @param typecode array typecode of a 4 byte type
+        @return array.array of num values, filled directly from the read data
+        '''
+        values = array(typecode)
+        data = self.stream.read(values.itemsize*num)
+        if len(data) != values.itemsize*num:
+            raise struct.error("unpack requires a buffer of %d bytes" % (values.itemsize*num))
+        values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def read_int_array(self, num, width=1):
+        '''
+        Reads num records of width integers each at once
+
+        @return array.array('I') of num*width values in the order of the data
+                (text streams return signed values, array.array('i')).
+                Use numpy.frombuffer(values, dtype=values.typecode).reshape(num, width)
+                to get a NumPy array without copying
+        '''
+        return self.read_array("I", num*width)
+
+    def read_float_array(self, num, width=1):
+        '''
+        Reads num records of width floats each at once
+
+        @return array.array('f') of num*width values, see read_int_array
+        '''
+        return self.read_array("f", num*width)
+
 class TextDataStream(BinaryDataStream):
     '''
     text version
@@ -71,22 +120,161 @@ class TextDataStream(BinaryDataStream):
         BinaryDataStream.__init__(self, bytestream)
         self.seq_delim = seq_delim
 
+    def _readline(self):
+        return self.stream.readline()
+
+    def _split_sequence(self, line):
+        #strip the line break first, else a delimiter at the end of the line would not be removed
+        return [a for a in line.decode('ascii').strip().strip(self.seq_delim).split(" ") if a != ""]
+
     def read_int(self):
-        return int(self.stream.readline())
+        return int(self._readline())
 
     def read_ints(self, num):
-        elements = [a for a in self.stream.readline().decode('ascii').strip(self.seq_delim).split(" ") if a != ""]
+        elements = self._split_sequence(self._readline())
         assert len(elements) == num
         return tuple(int(a) for a in elements)
 
     def read_float(self):
-        return float(self.stream.readline())
+        return float(self._readline())
 
     def read_floats(self, num):
-        elements = [a for a in self.stream.readline().decode('ascii').strip(self.seq_delim).split(" ") if a != ""]
+        elements = self._split_sequence(self._readline())
         assert len(elements) == num
         return tuple(float(a) for a in elements)
 
     def read_str(self):
-        return self.stream.readline().strip().decode("ascii")
+        return self._readline().strip().decode("ascii")
+
+    def read_int_array(self, num, width=1):
+        '''
+        Reads num lines of width integers each, see BinaryDataStream.read_int_array
+
+        @return array.array('i'), the values in text files may be negative
+        '''
+        values = array("i")
+        for i in range(num):
+            if width == 1:
+                values.append(self.read_int())
+            else:
+                values.extend(self.read_ints(width))
+        return values
+
+    def read_float_array(self, num, width=1):
+        '''
+        Reads num lines of width floats each, see BinaryDataStream.read_float_array
+
+        @return array.array('d'), so the values are the same as the ones of read_float and read_floats
+        '''
+        values = array("d")
+        for i in range(num):
+            if width == 1:
+                values.append(self.read_float())
+            else:
+                values.extend(self.read_floats(width))
+        return values
+
+class TokenizedTextDataStream(TextDataStream):
+    '''
+    text version reading the whole input at once
+
+    The input is split into lines once, so the scalar readers behave exactly
+    like those of TextDataStream without a readline() call each. The array
+    readers split a whole run of lines into tokens at once and convert them in
+    batch. Unlike TextDataStream they do not check the number of values per
+    line, only the total number.
+    '''
+    def __init__(self, bytestream, skip_lines=0, seq_delim=""):
+        '''
+        @param bytestream stream or bytes-like object containing the text, read to its end
+        @param skip_lines, seq_delim see TextDataStream
+        '''
+        data = bytestream.read() if hasattr(bytestream, "read") else bytes(bytestream)
+        BinaryDataStream.__init__(self, None)
+        self.seq_delim = seq_delim
+        self.lines = data.split(b"\n")
+        #like readline(), all lines but the last keep their line break
+        for i in range(len(self.lines) - 1):
+            self.lines[i] += b"\n"
+        if self.lines[-1] == b"":
+            del self.lines[-1]
+        self.lineno = min(skip_lines, len(self.lines))
+
+    def _readline(self):
+        if self.lineno == len(self.lines):
+            return b""
+        self.lineno += 1
+        return self.lines[self.lineno - 1]
+
+    def _readlines(self, num):
+        lines = self.lines[self.lineno:self.lineno + num]
+        self.lineno += len(lines)
+        return lines
+
+    def _read_tokens(self, num, width, typecode, convert):
+        lines = self._readlines(num)
+        if width == 1:
+            assert len(lines) == num
+            return array(typecode, map(convert, lines))
+        if self.seq_delim:
+            delim = self.seq_delim.encode('ascii')
+            lines = [line.strip().strip(delim) for line in lines]
+        tokens = b" ".join(lines).split()
+        assert len(tokens) == num*width
+        return array(typecode, map(convert, tokens))
+
+    def read_int_array(self, num, width=1):
+        return self._read_tokens(num, width, "i", int)
+
+    def read_float_array(self, num, width=1):
+        return self._read_tokens(num, width, "d", float) #see TextDataStream.read_float_array
+
+#Testcode
+
+import io
+
+def test_read_arrays():
+    data = struct.pack("<2I6f", 1, 2, 0.5, 1.5, 2.5, 3.5, 4.5, 5.5)
+    text = b"1\n2\n0.5 1.5\n2.5 3.5\n4.5 5.5\n"
+    for stream, typecode in ((BinaryDataStream(io.BytesIO(data)), "f"), (TextDataStream(io.BytesIO(text)), "d"), (TokenizedTextDataStream(io.BytesIO(text)), "d")):
+        ints = stream.read_int_array(2)
+        floats = stream.read_float_array(3, 2)
+        assert ints.tolist() == [1, 2] and ints.typecode in ("I", "i")
+        assert (floats.typecode, floats.tolist()) == (typecode, [0.5, 1.5, 2.5, 3.5, 4.5, 5.5])
+    try:
+        BinaryDataStream(io.BytesIO(data)).read_int_array(3, 3)
+        assert False
+    except struct.error:
+        pass
+
+def test_read_negative_ints_from_text():
+    #bone bindings in SKN files use -1 for "no blended vertices"
+    ints = TextDataStream(io.BytesIO(b"0 0 3 -1 0\r\n")).read_int_array(1, 5)
+    assert (ints.typecode, ints.tolist()) == ("i", [0, 0, 3, -1, 0])
+
+def test_tokenized_text_data_stream():
+    text = b"// header\r\nversion 300\r\nname with spaces\r\n 7\r\n|1.5 -2 3|\r\n4 5\r\n2.5\r\n"
+    def read_all(stream):
+        return (stream.read_str(), stream.read_int(), stream.read_floats(3), stream.read_ints(2), stream.read_float(), stream.read_str())
+    expected = read_all(TextDataStream(io.BytesIO(text), skip_lines=2, seq_delim="|"))
+    assert expected == ("name with spaces", 7, (1.5, -2.0, 3.0), (4, 5), 2.5, "")
+    assert read_all(TokenizedTextDataStream(io.BytesIO(text), skip_lines=2, seq_delim="|")) == expected
+    stream = TokenizedTextDataStream(text, skip_lines=4, seq_delim="|")
+    assert stream.read_float_array(1, 3).tolist() == [1.5, -2.0, 3.0]
+    assert stream.read_int_array(1, 2).tolist() == [4, 5]
+    #bone bindings in SKN files and values in CMX files may be -1
+    stream = TokenizedTextDataStream(b"-1\r\n| 0 0 3 -1 0 |\r\n", seq_delim="|")
+    ints = stream.read_int_array(1)
+    assert (ints.typecode, ints.tolist()) == ("i", [-1])
+    assert stream.read_int_array(1, 5).tolist() == [0, 0, 3, -1, 0]
 
+def test_text_float_arrays_are_not_rounded():
+    #text files contain decimal values which are not representable as float32
+    text = b"0.1\r\n-2.3\r\n| 0.1 0.2 1e-07 |\r\n| 3.3 4.4 5.5 |\r\n"
+    def read_per_value(stream):
+        return [stream.read_float(), stream.read_float()] + list(stream.read_floats(3)) + list(stream.read_floats(3))
+    expected = read_per_value(TextDataStream(io.BytesIO(text), seq_delim="|"))
+    assert expected[:3] == [0.1, -2.3, 0.1]
+    for cls in (TextDataStream, TokenizedTextDataStream):
+        stream = cls(io.BytesIO(text), seq_delim="|")
+        assert stream.read_float_array(2).tolist() + stream.read_float_array(2, 3).tolist() == expected
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+Parallel extraction of byte ranges from a physical file into
+individual files
+
+Used by extract_far and extract_iff. Each range is copied from file
+to file without passing the data through Python where the operating
+system allows it (copy_file_range, sendfile). Otherwise the data is
+copied with pread in chunks of limited size, so even huge entries only
+require a bounded amount of memory.
+'''
+
+import io
+import os
+import errno
+from concurrent.futures import ThreadPoolExecutor
+
+from .subfile import SubFile, PositionalSubFile
+
+default_chunk_size = 1 << 20
+
+#errors signalling that a zero-copy system call is not usable for the given pair of files
+_unsupported_errnos = set([errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EBADF, errno.ENOTSUP, errno.EOPNOTSUPP])
+
+def physical_file_location(stream):
+    '''
+    @return tuple (file descriptor, offset) if stream is a physical file or a subrange
+            of one (SubFile, PositionalSubFile), where offset is the position of the
+            stream's first byte inside the file. Else None.
+    '''
+    if isinstance(stream, PositionalSubFile):
+        return stream.fd, stream.base_offset
+    off = 0
+    if isinstance(stream, SubFile):
+        off = stream.base_offset
+        stream = stream.base_stream
+    raw = getattr(stream, "raw", stream)
+    if not isinstance(raw, io.FileIO):
+        return None
+    return raw.fileno(), off
+
+def _copy_file_range(src_fd, dst_fd, off, length):
+    copied = 0
+    while copied < length:
+        num = os.copy_file_range(src_fd, dst_fd, length - copied, off + copied)
+        if num == 0:
+            break
+        copied += num
+    return copied
+
+def _sendfile(src_fd, dst_fd, off, length):
+    copied = 0
+    while copied < length:
+        num = os.sendfile(dst_fd, src_fd, off + copied, length - copied)
+        if num == 0:
+            break
+        copied += num
+    return copied
+
+def _pread_copy(src_fd, dst_fd, off, length, chunk_size):
+    copied = 0
+    while copied < length:
+        data = os.pread(src_fd, min(chunk_size, length - copied), off + copied)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        copied += len(data)
+    return copied
+
+def copy_range(src_fd, off, length, dst_path, chunk_size=default_chunk_size):
+    '''
+    Copies length bytes starting at off from src_fd into a new file dst_path
+
+    Neither the file position of src_fd is used nor changed, so this
+    can be called from multiple threads for the same src_fd.
+
+    @return number of bytes copied (less than length if src_fd ends prematurely)
+    '''
+    dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        for zero_copy in (getattr(os, "copy_file_range", None) and _copy_file_range,
+                          getattr(os, "sendfile", None) and _sendfile):
+            if not zero_copy:
+                continue
+            try:
+                return zero_copy(src_fd, dst_fd, off, length)
+            except OSError as e:
+                if e.errno not in _unsupported_errnos:
+                    raise
+                #nothing has been written if the call is not supported at all
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+        return _pread_copy(src_fd, dst_fd, off, length, chunk_size)
+    finally:
+        os.close(dst_fd)
+
+def extract_ranges(src_fd, jobs, max_workers=None, chunk_size=default_chunk_size):
+    '''
+    Copies ranges of src_fd into individual files using a thread pool
+
+    @param jobs iterable of tuples (offset, length, destination path). The ranges are
+                processed in order of their offsets. If a destination path occurs more
+                than once, only the last job for that path is executed (matching the
+                result of extracting the ranges one after the other)
+    @param max_workers number of threads, see concurrent.futures.ThreadPoolExecutor
+    @param chunk_size maximum number of bytes held in memory per thread if the data cannot be
+                      copied without passing through Python
+    '''
+    last_job_for_path = {}
+    for job in jobs:
+        last_job_for_path[job[2]] = job
+    jobs = sorted(last_job_for_path.values(), key=lambda job: job[0])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(copy_range, src_fd, off, length, dst_path, chunk_size)
+                   for off, length, dst_path in jobs]
+        for future in futures:
+            future.result() #propagate errors
@@ -23,8 +23,16 @@ http://simtech.sourceforge.net/tech/far.html
 '''
 
 import struct
+import mmap
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from fnmatch import fnmatchcase
 
 from .subfile import SubFile as FreeFarFileEntryStream
+from .subfile import BufferSubFile, open_subfile
+from .tables import FarManifestTable
+from .fileiocommon import iter_ranges
+from . import instrumentation
 
 class FARIOError(IOError):
     '''
@@ -34,6 +42,45 @@ class FARIOError(IOError):
     def __init__(self, *args, **kwargs):
         IOError.__init__(self, *args, **kwargs)
 
+def normalize_far_filename(filename):
+    '''
+    Canonical form of a filename inside a FAR archive used for
+    tolerant lookups: The Sims™ itself does not care about case and
+    manifests use "\\" as path separator, so we lower-case the name and
+    replace any "/" by "\\"
+    '''
+    return filename.replace("/", "\\").lower()
+
+def read_far_header(stream):
+    '''
+    Reads the header at the beginning of a FAR file
+
+    @return offset of the manifest
+    '''
+    signature = stream.read(8)
+    if bytes(signature) != b"FAR!byAZ":
+        raise FARIOError("FAR signature is missing, propably not a FAR file")
+    version, manifest_offset = struct.unpack("<iI", stream.read(8))
+    return manifest_offset
+
+@instrumentation.timed("far.read_far_manifest")
+def read_far_manifest(stream, pool=None):
+    '''
+    Reads the manifest of a FAR file. Only reads sequentially, so the
+    stream does not have to be seekable.
+
+    @param stream stream pointing to the beginning of the manifest
+    @param pool tables.StringPool for the filenames, allows sharing strings between archives
+    @return FarManifestTable with one row for every file entry
+    '''
+    table = FarManifestTable(pool)
+    num_entries, = struct.unpack("<I", stream.read(4))
+    for i in range(num_entries):
+        file_len1, file_len2, file_off, filename_len = struct.unpack("<IIII", stream.read(16))
+        filename = stream.read(filename_len).decode('ascii')
+        table.append(filename, file_off, file_len1, file_len2)
+    return table
+
 class FarFile(object):
     '''
     Represents a FAR file
@@ -42,6 +89,11 @@ class FarFile(object):
     then allows for read-only access of individual entries via
     a file-like object.
 
+    The manifest is stored as a FarManifestTable (see tables.py). Entries
+    are indexed by their exact filename as well as by their normalized
+    filename (see normalize_far_filename), so lookups do not depend on
+    the number of entries in the archive.
+
     This is the base class which is agnostic whether we operate on a
     physical FAR file or just some data stream.
 
@@ -51,6 +103,8 @@ class FarFile(object):
         '''
         Helper class to represent the entries in the FAR file
         '''
+        __slots__ = ("filename", "off", "len1", "len2")
+
         def __init__(self, filename, off, len1, len2):
             self.filename = filename
             self.off = off
@@ -66,67 +120,341 @@ class FarFile(object):
         '''
         raise StandardError("implementation missing!")
 
-    def __init__(self, databuffer):
+    def __init__(self, databuffer, pool=None):
         '''
         @param databuffer open stream containing the FAR file and nothing more!
+        @param pool see read_far_manifest
 
         NOTE: The stream is not closed
 
         TODO: implement write access
         '''
 
-        self.__entries = []
+        manifest_offset = read_far_header(databuffer)
+        databuffer.seek(manifest_offset)
+        self._set_entries(read_far_manifest(databuffer, pool))
 
-        signature = databuffer.read(8)
-        if bytes(signature) != b"FAR!byAZ":
-            raise FARIOError("FAR signature is missing, propably not a FAR file")
-        version, manifest_offset = struct.unpack("<iI", databuffer.read(8))
-        #Read the Manifest, create an entry for every file entry
+    @classmethod
+    def from_entries(cls, entries):
+        '''
+        Creates a FarFile object from already known manifest entries
+        instead of reading them from a stream (see indexcache.py)
 
-        def read_manifest_entry():
-            '''
-            helper function to read manifest entry
-            '''
-            file_len1, file_len2, file_off, filename_len = struct.unpack("<IIII", databuffer.read(16))
-            filename = databuffer.read(filename_len).decode('ascii')
-            #print(filename, file_len1, file_len2, file_off)
-            return (filename, file_off, file_len1, file_len2)
+        @param entries FarManifestTable or iterable of FarFileEntry objects in manifest order
+        '''
+        farfile = cls.__new__(cls)
+        farfile._set_entries(entries)
+        return farfile
 
-        databuffer.seek(manifest_offset)
-        num_entries, = struct.unpack("<I", databuffer.read(4))
-        for i in range(num_entries):
-            entry = FarFile.FarFileEntry(*read_manifest_entry())
-            self.__entries.append(entry)
+    def _set_entries(self, entries):
+        '''
+        Stores the manifest entries and creates the lookup table for them.
+        If a filename occurs more than once in the manifest, the first
+        entry wins (like it did for the former linear search)
+
+        The lookup tables map filenames to row indices of the manifest table.
+        The table for normalized filenames is only created on first use.
+        '''
+        if not isinstance(entries, FarManifestTable):
+            entries = FarManifestTable.from_entries(entries)
+        self.__entries = entries
+        self.__index = {}
+        self.__normalized_index = None
+        for index, filename_id in enumerate(entries.filename_ids):
+            self.__index.setdefault(entries.pool[filename_id], index)
+
+    def __get_normalized_index(self):
+        if self.__normalized_index is None:
+            normalized_index = {}
+            for index, filename_id in enumerate(self.__entries.filename_ids):
+                normalized_index.setdefault(normalize_far_filename(self.__entries.pool[filename_id]), index)
+            self.__normalized_index = normalized_index
+        return self.__normalized_index
+
+    def get_entry(self, filename, normalize=False):
+        '''
+        Looks up the manifest entry of a file without opening a stream.
+        The returned FarManifestTable.Row provides offset (off) and length (len1)
+        of the file inside the archive.
+
+        @param normalize if True, case and "/" vs. "\\" are ignored during lookup
+        '''
+        try:
+            if normalize:
+                return self.__entries[self.__get_normalized_index()[normalize_far_filename(filename)]]
+            else:
+                return self.__entries[self.__index[filename]]
+        except KeyError:
+            raise FARIOError("No such file in FAR file: '" + str(filename) + "'")
+
+    def contains(self, filename, normalize=False):
+        '''
+        @param normalize see get_entry
+        '''
+        if normalize:
+            return normalize_far_filename(filename) in self.__get_normalized_index()
+        else:
+            return filename in self.__index
+
+    def glob(self, pattern, normalize=False):
+        '''
+        Lists the filenames matching a shell-style pattern (see fnmatch).
+
+        @param normalize if True, both pattern and filenames are normalized before matching
+        @return list of filenames in manifest order
+        '''
+        if normalize:
+            pattern = normalize_far_filename(pattern)
+            return [filename for filename in self.filenames
+                    if fnmatchcase(normalize_far_filename(filename), pattern)]
+        return [filename for filename in self.filenames if fnmatchcase(filename, pattern)]
 
-    def open(self, filename, stream):
+    def filenames_with_prefix(self, prefix, normalize=False):
+        '''
+        Lists the filenames starting with prefix, e.g. "People\\"
+
+        @param normalize see glob
+        @return list of filenames in manifest order
+        '''
+        if normalize:
+            prefix = normalize_far_filename(prefix)
+            return [filename for filename in self.filenames
+                    if normalize_far_filename(filename).startswith(prefix)]
+        return [filename for filename in self.filenames if filename.startswith(prefix)]
+
+    def open(self, filename, stream, normalize=False, buffer_size=None):
         '''
         @param stream open Stream which contains the complete FAR file and nothing more! This stream is repositioned and returned
                       to point to the file entry.
+        @param normalize see get_entry
+        @param buffer_size if given, the returned stream is an io.BufferedReader using a buffer of that size
 
         NOTE: It is not checked whether the stream is actually equivalent to the one the FAR file object was created with
         '''
-        if not filename in self.filenames:
-            raise FARIOError("No such file in FAR file: '" + str(filename) + "'")
-        for entry in self.__entries:
-            if filename == entry.filename:
-                return FreeFarFileEntryStream(stream, entry.off, entry.len1)
+        entry = self.get_entry(filename, normalize)
+        return open_subfile(stream, entry.off, entry.len1, buffer_size)
+
+    def iter_many(self, filenames, stream, normalize=False):
+        '''
+        Reads many files at once. The files are read in order of their offsets
+        in the archive and neighbouring files are read with a single read
+        (see fileiocommon.iter_ranges), which turns random into sequential I/O.
+
+        @param filenames iterable of filenames
+        @param stream see open
+        @param normalize see get_entry
+        @return generator of tuples (filename, memoryview of the file's content) in order
+                of the offsets of the files in the archive
+        '''
+        entries = [(filename, self.get_entry(filename, normalize)) for filename in filenames]
+        return iter_ranges(stream, [(filename, entry.off, entry.len1) for filename, entry in entries])
+
+    def read_many(self, filenames, stream, normalize=False):
+        '''
+        see iter_many
+
+        @return dict filename -> bytes
+        '''
+        return dict((filename, bytes(data)) for filename, data in self.iter_many(filenames, stream, normalize))
 
     def __get_filenames(self):
-        for entry in self.__entries:
-            yield entry.filename
+        pool = self.__entries.pool
+        for filename_id in self.__entries.filename_ids:
+            yield pool[filename_id]
+
+    def __get_entries(self):
+        return iter(self.__entries)
+
+    def __contains__(self, filename):
+        return filename in self.__index
 
     def __len__(self):
         return len(self.__entries)
 
     filenames = property(__get_filenames)
+    entries = property(__get_entries)
+
+class MappedFarFile(FarFile):
+    '''
+    Represents a physical FAR file which is memory-mapped once.
+
+    Entries are served directly from the mapped pages: open() returns
+    BufferSubFile streams which read without any seek or read system call,
+    view() returns a memoryview of the entry without copying anything.
+    Streams returned by open() can be handed to all parsers (IFF, BMF,
+    BCF, CFP); IFF resources opened from such a stream are views on the
+    mapping as well.
+
+    The mapping is released by close(). This fails (BufferError) as long as
+    memoryviews obtained by view() or BufferSubFile.getbuffer() are alive.
+    '''
+    def __init__(self, fileobj):
+        '''
+        @param fileobj open physical file (anything providing fileno()) containing the FAR file
+
+        NOTE: fileobj is not closed, the mapping stays valid if it is closed though
+        '''
+        try:
+            self.mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: #empty file cannot be mapped
+            raise FARIOError("FAR signature is missing, propably not a FAR file")
+        try:
+            FarFile.__init__(self, BufferSubFile(self.mmap))
+        except:
+            self.mmap.close()
+            raise
+
+    def open(self, filename, stream=None, normalize=False, buffer_size=None):
+        '''
+        @param stream ignored, only present for compatibility with FarFile.open
+        @param normalize see FarFile.get_entry
+        @param buffer_size ignored, reads from the mapping do not need buffering
+        '''
+        entry = self.get_entry(filename, normalize)
+        return BufferSubFile(self.mmap, entry.off, entry.len1)
+
+    def iter_many(self, filenames, stream=None, normalize=False):
+        '''
+        see FarFile.iter_many. The memoryviews returned point into the mapping,
+        see view()
+
+        @param stream ignored, only present for compatibility with FarFile.iter_many
+        '''
+        return FarFile.iter_many(self, filenames, BufferSubFile(self.mmap), normalize)
+
+    def read_many(self, filenames, stream=None, normalize=False):
+        return FarFile.read_many(self, filenames, BufferSubFile(self.mmap), normalize)
+
+    def view(self, filename, normalize=False):
+        '''
+        @param normalize see FarFile.get_entry
+        @return read-only memoryview of the file's content
+        '''
+        entry = self.get_entry(filename, normalize)
+        return memoryview(self.mmap)[entry.off:entry.off+entry.len1]
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class StreamingFarFile(FarFile):
+    '''
+    Represents a FAR file read from a non-seekable stream like a pipe or a socket
+
+    The manifest of a FAR file is located behind the file data, so the data
+    has to be kept until the manifest has arrived. It is spooled into a
+    tempfile.SpooledTemporaryFile which holds up to spool_max_size bytes in
+    memory and spills to a temporary file on disk beyond that. The manifest
+    itself is parsed directly from the input stream.
+
+    Entries are accessed via open() or iter_entries(), which yields them
+    in the order they are stored in the archive.
+    '''
+    def __init__(self, stream, spool_max_size=32*1024*1024, chunk_size=1024*1024):
+        '''
+        @param stream stream containing the FAR file, only read sequentially
+        @param spool_max_size maximum number of bytes kept in memory
+        @param chunk_size number of bytes copied at once into the spool
+
+        NOTE: The stream is not closed
+        '''
+        self.spool = SpooledTemporaryFile(max_size=spool_max_size)
+        header = _read_exactly(stream, 16)
+        manifest_offset = read_far_header(BytesIO(header))
+        if manifest_offset < len(header):
+            raise FARIOError("FAR manifest offset %d points into the header" % manifest_offset)
+        #The header is spooled as well, so offsets in the manifest are valid inside the spool
+        self.spool.write(header)
+        remaining = manifest_offset - len(header)
+        while remaining > 0:
+            chunk = stream.read(min(chunk_size, remaining))
+            if not chunk:
+                raise FARIOError("FAR file ends before its manifest")
+            self.spool.write(chunk)
+            remaining -= len(chunk)
+        self._set_entries(read_far_manifest(_ExactReader(stream)))
+
+    def open(self, filename, stream=None, normalize=False, buffer_size=None):
+        '''
+        @param stream ignored, only present for compatibility with FarFile.open
+        @param normalize see FarFile.get_entry
+        @param buffer_size see FarFile.open
+        '''
+        return FarFile.open(self, filename, self.spool, normalize, buffer_size)
+
+    def iter_many(self, filenames, stream=None, normalize=False):
+        '''
+        @param stream ignored, only present for compatibility with FarFile.iter_many
+        '''
+        return FarFile.iter_many(self, filenames, self.spool, normalize)
+
+    def read_many(self, filenames, stream=None, normalize=False):
+        return FarFile.read_many(self, filenames, self.spool, normalize)
+
+    def iter_entries(self):
+        '''
+        Yields (filename, stream) for every entry in order of the entries' offsets
+        '''
+        for entry in sorted(self.entries, key=lambda entry: entry.off):
+            yield entry.filename, open_subfile(self.spool, entry.off, entry.len1)
+
+    def close(self):
+        self.spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _read_exactly(stream, size):
+    '''
+    Reads exactly size bytes from a stream which may return less data
+    than requested per read (like raw sockets or pipes)
+    '''
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise FARIOError("Unexpected end of FAR file")
+        data += chunk
+    return data
+
+class _ExactReader(object):
+    '''
+    Wraps a stream so that read(size) always returns size bytes
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, size):
+        return _read_exactly(self.stream, size)
 
 from os.path import join
+from .extraction import physical_file_location, extract_ranges
 
-def extract_far(stream, output_path):
+def extract_far(stream, output_path, max_workers=None):
     '''
     Creates file for every far entry in output_path
+
+    If stream is a physical file or a subrange of one, the entries are
+    copied in parallel and in order of their offsets in the archive
+    (see extraction.py)
+
+    @param max_workers number of threads used for copying
     '''
     ff = FarFile(stream)
+    location = physical_file_location(stream)
+    if location is not None:
+        fd, base_offset = location
+        extract_ranges(fd, [(base_offset + entry.off, entry.len1, join(output_path, entry.filename))
+                            for entry in ff.entries], max_workers)
+        return
     for filename in ff.filenames:
         entrystream = ff.open(filename, stream)
         with open(join(output_path, filename), "wb") as fp:
@@ -135,19 +463,19 @@ def extract_far(stream, output_path):
 #Command-line utility
 if __name__ == "__main__":
     import sys
+    from shutil import copyfileobj
 
     def do_list(args):
-        ff = FarFile(args.instream)
-        for filename in ff.filenames:
+        for filename in args.farfile.filenames:
             print(filename)
 
     def do_cat(args):
-        ff = FarFile(args.instream)
-        if args.filename not in ff.filenames:
-            print("ERROR -- %s not found in %s" % (args.filename, ff.filenames))
+        ff = args.farfile
+        if args.filename not in ff:
+            print("ERROR -- %s not found in %s" % (args.filename, list(ff.filenames)))
             raise SystemExit(1)
         stream = ff.open(args.filename, args.instream)
-        sys.stdout.buffer.write(stream.read())
+        copyfileobj(stream, sys.stdout.buffer)
 
     import argparse
 
@@ -163,19 +491,23 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if sys.stdin.buffer.seekable():
-        args.instream = sys.stdin.buffer
+    args.instream = sys.stdin.buffer
+    if args.instream.seekable():
+        args.farfile = FarFile(args.instream)
     else:
-        #Because stdin is not seekable, we have to buffer it
-        buf = sys.stdin.buffer.read(2000000000) #2gb limit
-        args.instream = io.BytesIO(buf)
+        #Because stdin is not seekable, we have to spool the file data
+        args.farfile = StreamingFarFile(args.instream)
 
     args.func(args)
 
 #Testcode
 
-from .gamedata_for_tests import requires_known_farfile
+from .gamedata_for_tests import requires_known_farfile, make_far_file
+from .subfile import PositionalSubFile, BlockCache
 from io import SEEK_SET, SEEK_CUR, SEEK_END
+from concurrent.futures import ThreadPoolExecutor
+import io
+import tempfile
 
 try:
     from nose.tools import assert_raises
@@ -219,5 +551,139 @@ try:
         strm1.seek(-1, SEEK_CUR)
         assert strm1.tell()+1 == strm2.tell()
 
+    @requires_known_farfile
+    def test_mapped_far_file(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        with MappedFarFile(open(known_far_file.filename, "rb")) as mapped:
+            assert list(mapped.filenames) == list(farfile.filenames)
+            fname = known_far_file.get_any_filename()
+            data = farfile.open(fname, open(known_far_file.filename, "rb")).read()
+            assert mapped.open(fname).read() == data
+            view = mapped.view(fname)
+            assert len(view) == known_far_file.get_file_size(fname)
+            assert view == data
+            view.release()
+
+    def test_mapped_far_file_closes_map_on_error():
+        data = make_far_file([("a.iff", b"a"*10), ("b.iff", b"b"*20)])
+        for broken in (b"NOT A FAR FILE" + data[14:], data[:-10]):
+            with tempfile.TemporaryFile() as fp:
+                fp.write(broken)
+                fp.flush()
+                mapped = MappedFarFile.__new__(MappedFarFile)
+                assert_raises((FARIOError, struct.error), mapped.__init__, fp)
+                assert mapped.mmap.closed
+
+    @requires_known_farfile
+    def test_streaming_far_file(known_far_file):
+        class Pipe(object):
+            '''
+            non-seekable stream returning small chunks
+            '''
+            def __init__(self, stream):
+                self.stream = stream
+            def read(self, size=-1):
+                return self.stream.read(min(size, 4096) if size >= 0 else 4096)
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        with StreamingFarFile(Pipe(open(known_far_file.filename, "rb")), spool_max_size=65536) as streaming:
+            assert list(streaming.filenames) == list(farfile.filenames)
+            offsets = []
+            for filename, stream in streaming.iter_entries():
+                offsets.append(streaming.get_entry(filename).off)
+                assert stream.read() == farfile.open(filename, open(known_far_file.filename, "rb")).read()
+            assert offsets == sorted(offsets)
+
+    @requires_known_farfile
+    def test_positional_streams_in_threads(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        expected = dict((fname, farfile.open(fname, open(known_far_file.filename, "rb")).read())
+                        for fname in farfile.filenames)
+        with open(known_far_file.filename, "rb") as fp:
+            archive = PositionalSubFile(fp)
+            def read_entry(fname):
+                stream = farfile.open(fname, archive)
+                assert isinstance(stream, PositionalSubFile)
+                return fname, stream.read(10) + stream.read()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for fname, data in executor.map(read_entry, list(expected)*4):
+                    assert data == expected[fname]
+
+    @requires_known_farfile
+    def test_buffered_stream(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        fname = known_far_file.get_any_filename()
+        data = farfile.open(fname, open(known_far_file.filename, "rb")).read()
+        strm = farfile.open(fname, open(known_far_file.filename, "rb"), buffer_size=4096)
+        assert b"".join(iter(lambda: strm.read(7), b"")) == data
+        assert strm.seek(0) == 0
+        buf = bytearray(len(data) + 10)
+        assert strm.readinto(buf) == len(data)
+        assert bytes(buf[:len(data)]) == data
+        assert strm.seek(-3, SEEK_END) == len(data) - 3
+
+    @requires_known_farfile
+    def test_nested_streams_are_flat(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        fname = known_far_file.get_any_filename()
+        stream = open(known_far_file.filename, "rb")
+        strm = farfile.open(fname, stream)
+        nested = FreeFarFileEntryStream(FreeFarFileEntryStream(strm, 2, 100), 3, 10)
+        assert nested.base_stream is stream
+        assert nested.base_offset == farfile.get_entry(fname).off + 5
+        strm.seek(5)
+        assert nested.read() == strm.read(10)
+
+    @requires_known_farfile
+    def test_block_cache(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        cache = BlockCache(open(known_far_file.filename, "rb"), block_size=4096, max_bytes=64*1024)
+        archive = cache.open()
+        for fname in farfile.filenames:
+            expected = farfile.open(fname, open(known_far_file.filename, "rb")).read()
+            strm1 = farfile.open(fname, archive)
+            strm2 = farfile.open(fname, archive)
+            assert b"".join(iter(lambda: strm1.read(13), b"")) == expected
+            assert strm2.read() == expected
+        stats = cache.stats()
+        assert stats["hits"] > 0 and stats["misses"] > 0
+        assert stats["cached_bytes"] <= 64*1024
+
+    @requires_known_farfile
+    def test_read_many(known_far_file):
+        stream = open(known_far_file.filename, "rb")
+        farfile = FarFile(stream)
+        filenames = list(reversed(list(farfile.filenames)))
+        expected = dict((fname, farfile.open(fname, stream).read()) for fname in filenames)
+        offsets = [farfile.get_entry(fname).off for fname, data in farfile.iter_many(filenames, stream)]
+        assert offsets == sorted(offsets)
+        assert farfile.read_many(filenames, stream) == expected
+        with MappedFarFile(open(known_far_file.filename, "rb")) as mapped:
+            assert mapped.read_many(filenames) == expected
+
+    @requires_known_farfile
+    def test_lookup_entries(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        for fname, (len1, len2, off) in known_far_file.contents.items():
+            entry = farfile.get_entry(fname)
+            assert (entry.len1, entry.len2, entry.off) == (len1, len2, off)
+            assert farfile.get_entry(fname.upper(), normalize=True) == entry
+        assert_raises(FARIOError, farfile.get_entry, "does not exist.iff")
+        assert set(farfile.glob("*Globals.iff")) == set(n for n in known_far_file.contents if n.endswith("Globals.iff"))
+        assert farfile.filenames_with_prefix("vacation", normalize=True) == farfile.glob("Vacation*")
+
+    @requires_known_farfile
+    def test_extract_far(known_far_file):
+        farfile = FarFile(open(known_far_file.filename, "rb"))
+        with open(known_far_file.filename, "rb") as fp:
+            data = fp.read()
+        #copying from the physical file in parallel and reading from a stream in memory
+        for stream in (open(known_far_file.filename, "rb"), io.BytesIO(data)):
+            with tempfile.TemporaryDirectory() as output_path:
+                extract_far(stream, output_path, max_workers=4)
+                for fname in farfile.filenames:
+                    entry = farfile.get_entry(fname)
+                    with open(join(output_path, fname), "rb") as fp:
+                        assert fp.read() == data[entry.off:entry.off+entry.len1]
+
 except ImportError:
     pass
@@ -20,6 +20,9 @@ Some commonly used utility functions to read TheSims™ files
 '''
 
 import struct
+from io import SEEK_CUR
+
+from .subfile import BufferSubFile
 
 def read_pascal_style_string(stream):
     length = struct.unpack("B", stream.read(1))[0]
@@ -27,8 +30,157 @@ def read_pascal_style_string(stream):
     return namestr
 
 def read_zero_zerminated_string(stream):
-    namestr = stream.read(1)
+    '''
+    @return the string including the terminating zero byte
+    '''
+    if stream.seekable():
+        #read ahead in chunks and return the surplus to the stream
+        namestr = b""
+        while True:
+            chunk = stream.read(64)
+            if not chunk:
+                raise IOError("Unterminated string")
+            end = chunk.find(b"\0")
+            if end != -1:
+                stream.seek(end + 1 - len(chunk), SEEK_CUR)
+                return namestr + chunk[:end+1]
+            namestr += chunk
+    namestr = bytearray(stream.read(1))
     while namestr[-1] != 0:
         namestr += stream.read(1)
-    return namestr
+    return bytes(namestr)
+
+class BufferCursor(object):
+    '''
+    Parses data from a buffer which has been read at once (or is mapped
+    into memory) instead of issuing small reads on a stream. The cursor
+    consists of the buffer and the current position inside of it.
+
+    Running past the end of the buffer raises struct.error (like
+    struct.unpack_from does) or IOError for unterminated strings.
+    '''
+    def __init__(self, buf, pos=0):
+        '''
+        @param buf bytes, bytearray or mmap object
+        @param pos initial position inside buf
+        '''
+        self.buf = buf
+        self.pos = pos
+
+    def unpack(self, fmt):
+        '''
+        @param fmt a precompiled struct.Struct
+        @return tuple of the unpacked values
+        '''
+        values = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def read(self, size):
+        if self.pos + size > len(self.buf):
+            raise struct.error("unpack requires a buffer of %d bytes" % size)
+        data = self.buf[self.pos:self.pos+size]
+        self.pos += size
+        return data
+
+    def skip(self, size):
+        self.pos += size
+
+    def remaining(self):
+        return len(self.buf) - self.pos
+
+    def read_zero_terminated_string(self):
+        '''
+        @return the string WITHOUT the terminating zero byte, which is skipped
+        '''
+        end = self.buf.find(b"\0", self.pos)
+        if end == -1:
+            raise IOError("Unterminated string at offset %d" % self.pos)
+        namestr = self.buf[self.pos:end]
+        self.pos = end + 1
+        return namestr
+
+    def read_pascal_style_string(self):
+        '''
+        @return string preceded by its length as single byte
+        '''
+        length = self.read(1)[0]
+        return self.read(length)
+
+    def read_fixed_string(self, size):
+        '''
+        @return string stored in a field of size bytes. If shorter, it
+                is zero-terminated and the zeros are cut off
+        '''
+        field = self.read(size)
+        end = field.find(b"\0")
+        return field if end == -1 else field[:end]
+
+
+def iter_ranges(stream, ranges, max_gap=64*1024, max_read_size=4*1024*1024):
+    '''
+    Reads many byte ranges of a stream in order of their offsets
+
+    Ranges which are adjacent or separated by at most max_gap bytes are
+    coalesced into a single read of at most max_read_size bytes (a single
+    range larger than that is read at once), so scattered small reads
+    become few large sequential ones. If stream is a subfile.BufferSubFile,
+    nothing is read at all and the data is sliced out of the buffer.
+
+    @param stream seekable stream
+    @param ranges iterable of tuples (key, offset, length), offsets relative to the start of stream
+    @return generator of tuples (key, data) in order of the offsets. data is a memoryview
+            which may be shorter than requested if the stream ends prematurely
+    '''
+    ranges = sorted(ranges, key=lambda r: r[1])
+    if isinstance(stream, BufferSubFile):
+        view = stream.getbuffer()
+        for key, offset, length in ranges:
+            yield key, view[offset:offset+length]
+        return
+
+    i = 0
+    while i < len(ranges):
+        #collect the ranges of the next read
+        start = ranges[i][1]
+        end = start + ranges[i][2]
+        j = i + 1
+        while j < len(ranges):
+            key, offset, length = ranges[j]
+            if offset > end + max_gap or max(end, offset + length) - start > max_read_size:
+                break
+            end = max(end, offset + length)
+            j += 1
+        stream.seek(start)
+        data = memoryview(stream.read(end - start))
+        for key, offset, length in ranges[i:j]:
+            yield key, data[offset-start:offset-start+length]
+        i = j
+
+#Testcode
+
+def test_buffer_cursor():
+    from io import BytesIO
+    data = b"\x05hello" + b"world\0" + b"fixed\0\0\0" + struct.pack("<IH", 7, 3)
+    cursor = BufferCursor(data)
+    assert cursor.read_pascal_style_string() == b"hello"
+    assert cursor.read_zero_terminated_string() == b"world"
+    assert cursor.read_fixed_string(8) == b"fixed"
+    assert cursor.unpack(struct.Struct("<IH")) == (7, 3)
+    assert cursor.remaining() == 0
+    stream = BytesIO(data)
+    assert read_pascal_style_string(stream) == b"hello"
+    assert read_zero_zerminated_string(stream) == b"world\0"
+    assert stream.read(5) == b"fixed"
 
+def test_iter_ranges():
+    from io import BytesIO
+    data = bytes(range(256))*64
+    ranges = [("c", 9000, 100), ("a", 10, 20), ("b", 25, 10), ("d", 16000, 1000)]
+    for stream in (BytesIO(data), BufferSubFile(data)):
+        result = list(iter_ranges(stream, ranges, max_gap=1024))
+        assert [key for key, view in result] == ["a", "b", "c", "d"]
+        for key, view in result:
+            offset, length = next((o, l) for k, o, l in ranges if k == key)
+            assert view == data[offset:offset+length][:len(view)]
+        assert len(result[-1][1]) == 384 #stream ends prematurely
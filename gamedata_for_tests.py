@@ -25,12 +25,20 @@ GameData. The filenames are:
 GameData/Global.far
 GameData/Objects/Objects.far
 GameData/UserData2/Characters/User00000.iff
+
+Tests decorated with requires_known_farfile or requires_known_iff_file
+also run on a synthetic copy of the known file with pseudo-random
+contents, so they run without the original GameData as well. Other tests
+build small FAR and IFF files in memory with make_far_file and
+make_iff_file.
 '''
 
 import os.path
 import functools
 import pdb
 import random
+import struct
+import tempfile
 
 official_gamedta_relpath = "TheSims_official_gamedata"
 
@@ -73,11 +81,19 @@ known_far_file = KnownFarFile(os.path.join(official_gamedta_relpath, "GameData",
 def requires_known_farfile(testfunc):
     '''
     Decorator to access known_far_file object
-    in test routine
+    in test routine. The test runs on the file from
+    the original GameData if it is present and always
+    on a synthetic copy of it (see make_copy_of_known_far_file)
     '''
     @functools.wraps(testfunc)
     def test_decorated():
-        testfunc(known_far_file=known_far_file)
+        if os.path.exists(known_far_file.filename):
+            testfunc(known_far_file=known_far_file)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, os.path.basename(known_far_file.filename))
+            with open(filename, "wb") as f:
+                f.write(make_copy_of_known_far_file(known_far_file))
+            testfunc(known_far_file=KnownFarFile(filename, known_far_file.contents.items()))
     return test_decorated
 
 class KnownIffFile(object):
@@ -150,11 +166,17 @@ known_iff_file = KnownIffFile(os.path.join(official_gamedta_relpath, "UserData2"
 def requires_known_iff_file(testfunc):
     '''
     Decorator to access known_iff_file object
-    in test routine
+    in test routine, see requires_known_farfile
     '''
     @functools.wraps(testfunc)
     def test_decorated():
-        testfunc(known_iff_file=known_iff_file)
+        if os.path.exists(known_iff_file.filename):
+            testfunc(known_iff_file=known_iff_file)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, os.path.basename(known_iff_file.filename))
+            with open(filename, "wb") as f:
+                f.write(make_copy_of_known_iff_file(known_iff_file))
+            testfunc(known_iff_file=KnownIffFile(filename, known_iff_file.rsmp, known_iff_file.glob, known_iff_file.contents))
     return test_decorated
 
 objects_far_filename =  os.path.join(official_gamedta_relpath, "GameData", "Objects", "Objects.far")
@@ -186,3 +208,98 @@ class requires_known_game_file(object):
         def test_decorated():
             testfunc(self.known_files[self.ftype][self.name])
         return test_decorated
+
+def make_far_file(entries):
+    '''
+    Builds a FAR file in memory
+
+    @param entries list of tuples (filename, data)
+    @return bytes
+    '''
+    body = b""
+    manifest = struct.pack("<I", len(entries))
+    for filename, data in entries:
+        filename = filename.encode("ascii")
+        manifest += struct.pack("<IIII", len(data), len(data), 16 + len(body), len(filename)) + filename
+        body += data
+    return b"FAR!byAZ" + struct.pack("<II", 1, 16 + len(body)) + body + manifest
+
+def make_iff_resource(typecode, resid, flags, name, content):
+    '''
+    @return bytes of a resource including its header
+    '''
+    return (typecode.encode("ascii") + struct.pack(">IHH", 76 + len(content), resid, flags) +
+            name.encode("ascii").ljust(64, b"\0") + content)
+
+def make_iff_file(resources, rsmp_version=0, unmapped=("XXXX",), tail=b""):
+    '''
+    Builds an IFF 2.5 file in memory. The resource map follows the signature,
+    the resources follow the resource map.
+
+    @param resources list of tuples (typecode, id, flags, name, content)
+    @param rsmp_version 0 (zero-terminated names) or 1 (pascal-style names)
+    @param unmapped typecodes of resources which are not listed in the resource map
+    @param tail data appended to the file
+    @return bytes
+    '''
+    def resource_map(start):
+        typelists = {}
+        offset = start
+        for typecode, resid, flags, name, content in resources:
+            if typecode not in unmapped:
+                typelists.setdefault(typecode, []).append((offset, resid, flags, name.encode("ascii")))
+            offset += 76 + len(content)
+        data = b""
+        for typecode, entries in typelists.items():
+            data += typecode.encode("ascii")[::-1] + struct.pack("<I", len(entries))
+            for offset, resid, flags, name in entries:
+                if rsmp_version == 0:
+                    data += struct.pack("<IHH", offset, resid, flags) + name + b"\0" + b"\0"*(len(name) % 2 == 0)
+                else:
+                    data += struct.pack("<IHI", offset, resid, flags) + bytes([len(name)]) + name + b"\0"*(len(name) % 2)
+        data = struct.pack("<II", 0, rsmp_version) + b"pmsr" + struct.pack("<II", 20 + len(data), len(typelists)) + data
+        return make_iff_resource("rsmp", 0, 16, "", data)
+
+    start = 64 + len(resource_map(0))
+    data = b"IFF FILE 2.5:TYPE FOLLOWED BY SIZE\0 JAMIE DOORNBOS & MAXIS 1" + struct.pack(">I", 64) + resource_map(start)
+    for resource in resources:
+        data += make_iff_resource(*resource)
+    return data + tail
+
+def _pseudo_random_bytes(size, prefix=b""):
+    '''
+    @return size bytes starting with prefix, the same for every call
+    '''
+    num = size - len(prefix)
+    return prefix + random.Random(size).getrandbits(8*num).to_bytes(num, "little")
+
+def make_copy_of_known_far_file(known):
+    '''
+    Builds a FAR file with the filenames, sizes and offsets of a KnownFarFile
+    and pseudo-random contents
+
+    @return bytes
+    '''
+    entries = sorted(known.contents.items(), key=lambda item: item[1][2])
+    return make_far_file([(filename, _pseudo_random_bytes(len1)) for filename, (len1, len2, off) in entries])
+
+def make_copy_of_known_iff_file(known):
+    '''
+    Builds an IFF file with the resource map, resource sizes and GLOB
+    resource of a KnownIffFile. Bitmaps start with "BM", the other
+    resources contain pseudo-random data
+
+    @return bytes
+    '''
+    sizes = dict(((e["typecode"], e["id"]), e["size"]) for e in known.contents)
+    entries = sorted((e["offset"], typelist["typecode"], e["id"], e["flags"], e["name"])
+                     for typelist in known.rsmp["typelists"] for e in typelist["entries"])
+    resources = []
+    for offset, typecode, resid, flags, name in entries:
+        size = sizes[(typecode, resid)] - 76
+        if typecode == "GLOB":
+            content = (bytes([len(known.glob)]) + known.glob.encode("ascii")).ljust(size, b" ")
+        else:
+            content = _pseudo_random_bytes(size, b"BM" if typecode == "BMP_" else b"")
+        resources.append((typecode, resid, flags, name, content))
+    return make_iff_file(resources, known.rsmp["version"])
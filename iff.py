@@ -24,11 +24,14 @@ See http://simtech.sourceforge.net/tech/iff.html
 
 import re
 import struct
-from itertools import chain
+from fnmatch import fnmatchcase
+from array import array
 from io import SEEK_SET, SEEK_END, SEEK_CUR, BytesIO
 
-from .subfile import SubFile
-from .fileiocommon import read_pascal_style_string, read_zero_zerminated_string
+from .subfile import open_subfile, BufferSubFile
+from .tables import ResourceHeaderTable, ResourceMapTable
+from .fileiocommon import BufferCursor, iter_ranges
+from . import instrumentation
 
 import logging
 
@@ -76,10 +79,52 @@ def read_resource_header_from_stream(stream):
         #there, else we will "import" those zeros into the final string
         namestr = namebuf.decode('ascii').rstrip('\0')
 
-    logger.debug("read ResourceHeader typecode=%s, size=%s, id=%d, flags=%s, name='%s'", typecode, size, resid, flags, namestr)
+    if instrumentation.active is not None:
+        instrumentation.active.count("headers_parsed")
 
     return IffResourceHeader(typecode, size, resid, flags, namestr)
 
+_resource_header = struct.Struct(">4sIHH")
+
+@instrumentation.timed("iff.scan_resource_headers")
+def scan_resource_headers(stream, start, chunk_size=1024*1024):
+    '''
+    Walks over all resource headers of an IFF file, reading the file in
+    large chunks instead of issuing several reads per resource. If stream
+    is a BufferSubFile (e.g. an entry of a MappedFarFile), the headers are
+    parsed directly from the buffer without reading at all.
+
+    @param stream Stream containing the complete IFF file
+    @param start offset of the first resource header (see IffFile.start)
+    @return ResourceHeaderTable
+    '''
+    table = ResourceHeaderTable()
+    end_of_file_off = stream.seek(0, SEEK_END)
+    if isinstance(stream, BufferSubFile):
+        buf = stream.buf
+        buf_off = -stream.off #offset of buf[0] relative to the start of the stream
+        buf_end = end_of_file_off
+    else:
+        buf = b""
+        buf_off = buf_end = 0
+    pos = start
+    #the -76 skips any "dummy tail" in the archive, see IffFile.iter_open
+    while pos < end_of_file_off - IffResourceHeader.length:
+        if pos + IffResourceHeader.length > buf_end:
+            stream.seek(pos)
+            buf = stream.read(max(chunk_size, IffResourceHeader.length))
+            buf_off = pos
+            buf_end = pos + len(buf)
+        i = pos - buf_off
+        typecode_buf, size, resid, flags = _resource_header.unpack_from(buf, i)
+        if size < IffResourceHeader.length:
+            raise IOError("Invalid size %d of IFF resource at offset %d" % (size, pos))
+        table.append(typecode_buf, size, resid, flags, pos, buf[i+12:i+IffResourceHeader.length])
+        pos += size
+    if instrumentation.active is not None:
+        instrumentation.active.count("headers_parsed", len(table))
+    return table
+
 class IffResourceTypeListEntry(object):
     '''
     Resource maps allow for quickly locating resources. For each resource, almost the same information as
@@ -87,6 +132,8 @@ class IffResourceTypeListEntry(object):
     the IFF file is given. Therefore we can not equal actual ResourceHeaders with TypeListEntries, though they share almost
     all properties.
     '''
+    __slots__ = ("typecode", "offset", "resid", "flags", "name")
+
     def __init__(self, typecode, offset, resid, flags, name):
         self.typecode = typecode        #Typecode is not actually explicitely defined in the type list entries in an IFF file but it is
                                         #the same for all entries of one type list. But for efficiency of implementation we use a flat
@@ -96,75 +143,149 @@ class IffResourceTypeListEntry(object):
         self.flags = flags              #flags of resource
         self.name = name                #name of resource
 
-def read_resource_typelist_entry(stream, typecode, version):
-    assert version == 1 or version == 0
-    if version == 0:
-        unpack_str = "<IHH"
-    else:
-        unpack_str = "<IHI"
-    dta = stream.read(struct.calcsize(unpack_str))
-    offset, resid, flags = struct.unpack(unpack_str, dta)
-
-    if version == 0: #-> zero-terminated string
-        namestr = read_zero_zerminated_string(stream)
-    else: #->Pascal-style string
-        namestr = read_pascal_style_string(stream)
+_typelist_header = struct.Struct("<4sI")
+_typelist_entry = {0: struct.Struct("<IHH"), 1: struct.Struct("<IHI")}
+_resource_map_header = struct.Struct("<II4sII")
 
-    padded_debug_str = ""
-    if len(namestr)  % 2 != 0:
-        stream.read(1) #padding
-        padded_debug_str = "(+1 padding-byte)"
-
-    logger.debug("read ResourceTypeListEntry offset=%s, id=%s, flags=%s, name='%s' %s", offset, resid, flags, namestr.decode('ascii', 'replace'), padded_debug_str)
-
-    return IffResourceTypeListEntry(typecode, offset, resid, flags, namestr.decode('ascii', 'replace'))
-
-def read_resource_typelist(stream, version):
+def read_resource_typelist(cursor, version, table, typecodes=None):
     '''
-    Reads list of resource entries of specific type from stream
-    @return flat list of resource map entries
+    Reads list of resource entries of specific type and appends them to table
+
+    @param cursor fileiocommon.BufferCursor pointing to the type list
+    @param version version of the resource map. In version 0, names are zero-terminated
+                   strings, in version 1 pascal-style strings.
+    @param table ResourceMapTable
+    @param typecodes if not None, the entries are only appended if the typecode of the list
+                     is contained in typecodes. The entries of other lists are walked over
+                     (a type list does not state its size), but their names are not decoded.
     '''
-    typecode_buf = struct.pack('<I', struct.unpack('>I', stream.read(4))[0]) #pack-unpack-maneuver is done to switch big-endian typecode into human-readable order
-    typecode = typecode_buf.decode('ascii')
-    num_entries, = struct.unpack("<I", stream.read(4))
-    logger.debug("read ResourceTypeList typecode='%s', num_entries=%s", typecode, num_entries)
-    return [read_resource_typelist_entry(stream, typecode, version) for i in range(num_entries)]
-
-def read_resource_map_from_stream(stream):
+    assert version == 1 or version == 0
+    typecode_buf, num_entries = cursor.unpack(_typelist_header)
+    typecode = typecode_buf[::-1].decode('ascii') #typecode is stored big-endian, reverse it into human-readable order
+    keep = typecodes is None or typecode in typecodes
+    entry_struct = _typelist_entry[version]
+    read_name = cursor.read_zero_terminated_string if version == 0 else cursor.read_pascal_style_string
+    #names are padded to an even length. For zero-terminated strings, the zero counts
+    terminator_length = 1 if version == 0 else 0
+    for i in range(num_entries):
+        offset, resid, flags = cursor.unpack(entry_struct)
+        namestr = read_name()
+        if (len(namestr) + terminator_length) % 2 != 0:
+            cursor.skip(1) #padding
+        if keep:
+            table.append(typecode, offset, resid, flags, namestr.decode('ascii', 'replace'))
+
+def read_resource_map_from_stream(stream, pool=None, size=None, typecodes=None):
     '''
     Resource Maps allow for quickly locating resources in an IFF file
     by caching the relevant infos of the resource headers.
 
-    Reads the content of the resource map resource from IFF file
-    @return flat list of resource map entries
+    Reads the content of the resource map resource from IFF file. The
+    content is read at once and parsed from memory.
+    @param stream stream pointing behind the header of the resource map resource
+    @param pool tables.StringPool for typecodes and names, allows sharing strings between files
+    @param size size of the content of the resource map resource. If None, the stream is read to its end
+    @param typecodes if not None, only the type lists of these typecodes are kept in the table.
+                     The content is read completely nevertheless
+    @return ResourceMapTable with one row per resource map entry
     '''
-    unknown, version = struct.unpack("<II", stream.read(8))
-    typecode_buf = struct.pack('<I', struct.unpack('>I', stream.read(4))[0]) #pack-unpack-maneuver is done to switch big-endian typecode into human-readable order
-    typecode = typecode_buf.decode('ascii')
+    data = stream.read() if size is None else stream.read(size)
+    return read_resource_map_from_buffer(data, pool, typecodes)
+
+@instrumentation.timed("iff.read_resource_map")
+def read_resource_map_from_buffer(buf, pool=None, typecodes=None):
+    '''
+    see read_resource_map_from_stream
+
+    @param buf bytes, bytearray or mmap object containing the content of the resource map resource
+    '''
+    cursor = BufferCursor(buf)
+    unknown, version, typecode_buf, size, num_types = cursor.unpack(_resource_map_header)
+    typecode = typecode_buf[::-1].decode('ascii') #typecode is stored big-endian, reverse it into human-readable order
     assert typecode == 'rsmp' #"rsmp" means "Resource Map"
-    size, num_types = struct.unpack("<II", stream.read(8))
     assert num_types < 100000 #sanity check
 
-    logger.debug("read ResourceMap typecode=%s, version=%s, size=%s, num_types=%s", typecode, version, size, num_types)
+    #all type lists are appended to one single table of entries
+    table = ResourceMapTable(pool)
+    for i in range(num_types):
+        read_resource_typelist(cursor, version, table, typecodes)
+    return table
+
+#Modes for IffFile.iter_open deciding whether the resource headers in the
+#file are walked in addition to the resource map
+RESCAN_ALWAYS = "always"    #always walk all resource headers (finds resources missing in the resource map)
+RESCAN_NEVER = "never"      #trust the resource map, only walk the headers if there is no resource map
+RESCAN_LAZY = "lazy"        #only walk the headers if the resource map fails a cheap validation, see IffFile.resource_map_is_stale
+
+class ResourceQuery(object):
+    '''
+    Declarative description of a set of IFF resources
+
+    In contrast to an arbitrary predicate, a query can be answered by the
+    index IffFile builds over the resource map without evaluating every
+    entry (see IffFile.query). Each criterion left at None matches
+    everything. A query is callable with a resource header or resource
+    map entry, so it can be passed anywhere a predicate is expected.
+    '''
+    def __init__(self, typecode=None, resid=None, flags_mask=0, flags=0, name=None):
+        '''
+        @param typecode typecode of the resources, e.g. 'BHAV'
+        @param resid either a single id or a range of ids, e.g. range(4096, 8192)
+        @param flags_mask, flags resources match if resource.flags & flags_mask == flags
+        @param name shell-style pattern for the name of the resources (see fnmatch)
+        '''
+        self.typecode = typecode
+        self.resid = resid
+        self.flags_mask = flags_mask
+        self.flags = flags
+        self.name = name
+
+    def matches_resid(self, resid):
+        if self.resid is None:
+            return True
+        if isinstance(self.resid, range):
+            return resid in self.resid
+        return resid == self.resid
 
-    #read_resource_typelist returns list of entries each, so we flatten them into
-    #one single list of entries
-    gen_of_typelists = (read_resource_typelist(stream, version) for i in range(num_types))
-    return list(chain.from_iterable(gen_of_typelists))
+    def __call__(self, header):
+        return ((self.typecode is None or header.typecode == self.typecode) and
+                self.matches_resid(header.resid) and
+                header.flags & self.flags_mask == self.flags and
+                (self.name is None or fnmatchcase(header.name, self.name)))
 
 class IffFile(object):
     '''
     Represents an IFF file, allows access to individual resource entries.
 
     Requires an open stream to operate!
+
+    If the IFF file has a resource map, it is stored as a ResourceMapTable
+    (see tables.py) and indexed by typecode, (typecode, id) and name
+    during creation, so find() and query() can answer lookups without
+    accessing the file.
+
+    If created with lazy=True, only the signature is read on creation.
+    The resource map is parsed on first use by a method which is given a
+    stream (find and query accept an optional stream for that purpose).
+    Until then, glob() does not load the resource map: It still reads the
+    complete resource map resource (its type lists carry no sizes which
+    would allow skipping them), but only keeps the GLOB type list and
+    neither decodes the other names nor builds the index.
     '''
 
-    def __init__(self, stream):
+    @instrumentation.timed("iff.IffFile")
+    def __init__(self, stream, rescan=RESCAN_ALWAYS, pool=None, lazy=False):
         '''
         @param stream Stream containing the complete IFF file.
+        @param rescan default mode for iter_open: RESCAN_ALWAYS, RESCAN_NEVER or RESCAN_LAZY
+        @param pool tables.StringPool to store typecodes and names in. Pass the same pool
+                    for many IffFile objects to share strings between them
+        @param lazy if True, the resource map is not read before it is needed, see load_resource_map.
+                    Until then, resource_map is None and resource_map_loaded is False
 
         The stream object is NOT stored in the IffFile object
         '''
+        self.rescan = rescan
 
         def chop_next_string(data):
             '''
@@ -209,17 +330,190 @@ class IffFile(object):
             raise IOError("Unsupported IFF file version %s" % version)
 
         self.start = stream.tell() #Where the resource entries start
-        if rsmp_offset != 0: #if == 0, no resource map is present
-            #read resource map
-            logger.debug("Resource map present in IFF file")
-            stream.seek(rsmp_offset, SEEK_SET)
-            resmapheader = read_resource_header_from_stream(stream)
-            if resmapheader.typecode != 'rsmp':
-                raise IOError("Expected typecode 'rsmp', found '%s'" % resmapheader.typecode)
-            self.resource_map = read_resource_map_from_stream(stream)
+        self.rsmp_offset = rsmp_offset
+        self.pool = pool
+        self.resource_map = None
+        self.resource_map_loaded = False
+        self._build_index()
+        if not lazy:
+            self.load_resource_map(stream)
+
+    def __read_resource_map(self, stream, typecodes=None):
+        '''
+        @return ResourceMapTable, see read_resource_map_from_stream
+        '''
+        stream.seek(self.rsmp_offset, SEEK_SET)
+        resmapheader = read_resource_header_from_stream(stream)
+        if resmapheader.typecode != 'rsmp':
+            raise IOError("Expected typecode 'rsmp', found '%s'" % resmapheader.typecode)
+        return read_resource_map_from_stream(stream, self.pool, resmapheader.size - IffResourceHeader.length, typecodes)
+
+    def load_resource_map(self, stream):
+        '''
+        Reads and indexes the resource map unless this has been done already
+
+        @param stream Stream containing the complete IFF file
+        @return resource_map
+        '''
+        if not self.resource_map_loaded:
+            if self.rsmp_offset != 0: #if == 0, no resource map is present
+                logger.debug("Resource map present in IFF file")
+                self.resource_map = self.__read_resource_map(stream)
+            else:
+                logger.debug("No resource map present in IFF file")
+            self.resource_map_loaded = True
+            self._build_index()
+        return self.resource_map
+
+    def __require_resource_map(self, stream):
+        if not self.resource_map_loaded:
+            if stream is None:
+                raise IOError("Resource map of lazily created IffFile not loaded yet, a stream is required")
+            self.load_resource_map(stream)
+
+    @classmethod
+    def from_resource_map(cls, start, resource_map, rsmp_offset=0, rescan=RESCAN_ALWAYS):
+        '''
+        Creates an IffFile object from already known data instead of
+        reading it from a stream (see indexcache.py)
+
+        @param start offset of the first resource entry in the IFF file
+        @param resource_map ResourceMapTable, list of IffResourceTypeListEntry objects or None if the IFF
+                            file has no resource map
+        @param rsmp_offset offset of the resource map resource, 0 if unknown
+        @param rescan see __init__
+        '''
+        if resource_map is not None and not isinstance(resource_map, ResourceMapTable):
+            resource_map = ResourceMapTable.from_entries(resource_map)
+        ifffile = cls.__new__(cls)
+        ifffile.rescan = rescan
+        ifffile.start = start
+        ifffile.rsmp_offset = rsmp_offset
+        ifffile.pool = None
+        ifffile.resource_map = resource_map
+        ifffile.resource_map_loaded = True
+        ifffile._build_index()
+        return ifffile
+
+    def _build_index(self):
+        '''
+        Creates the lookup tables for the resource map. If an (typecode, id)
+        pair occurs more than once, the first entry in the map wins.
+
+        The lookup tables map pool ids of typecodes and names to row
+        indices of the resource map table.
+        '''
+        self.__map_is_stale = None
+        self.__sizes = None         #offset -> (size, exact) derived from the map, see __derive_sizes
+        self.__header_sizes = {}    #offset -> size read from the resource header
+        self.__by_typecode = {}
+        self.__by_type_id = {}
+        self.__by_name = {}
+        if self.resource_map is None:
+            return
+        table = self.resource_map
+        for index, (typecode_id, resid, name_id) in enumerate(zip(table.typecode_ids, table.resids, table.name_ids)):
+            self.__by_typecode.setdefault(typecode_id, array("I")).append(index)
+            self.__by_type_id.setdefault((typecode_id << 16) | resid, index)
+            self.__by_name.setdefault(name_id, array("I")).append(index)
+
+    def find(self, typecode, resid, stream=None):
+        '''
+        Looks up a resource in the resource map without accessing the file
+
+        @param stream only required if the IffFile was created lazily and the resource map is not loaded yet
+        @return ResourceMapTable.Row or None if there is no such resource in the resource map
+        '''
+        self.__require_resource_map(stream)
+        if self.resource_map is None:
+            return None
+        typecode_id = self.resource_map.pool.ids.get(typecode)
+        if typecode_id is None:
+            return None
+        index = self.__by_type_id.get((typecode_id << 16) | resid)
+        return self.resource_map[index] if index is not None else None
+
+    def query(self, query, stream=None):
+        '''
+        Answers a ResourceQuery from the index of the resource map without
+        accessing the file. Resources not listed in the resource map are not
+        found, use iter_open to include those.
+
+        @param stream see find
+        @return list of matching ResourceMapTable.Row objects in resource map order
+        '''
+        self.__require_resource_map(stream)
+        table = self.resource_map
+        if table is None:
+            return []
+        if query.typecode is not None and query.resid is not None and not isinstance(query.resid, range):
+            entry = self.find(query.typecode, query.resid)
+            return [entry] if entry is not None and query(entry) else []
+        elif query.typecode is not None:
+            candidates = self.__by_typecode.get(table.pool.ids.get(query.typecode), [])
+        elif query.name is not None and not any(c in query.name for c in "*?["):
+            candidates = self.__by_name.get(table.pool.ids.get(query.name), [])
         else:
-            logger.debug("No resource map present in IFF file")
-            self.resource_map = None
+            #filter the columns of the table, vectorised if NumPy is available
+            return [table[index] for index in table.select(query)]
+        return [row for row in (table[index] for index in candidates) if query(row)]
+
+    def open_resource(self, typecode, resid, stream):
+        '''
+        Opens the resource with the given typecode and id. Uses the index of
+        the resource map, falls back to searching the file.
+
+        @return file-like object accessing resource data (including resource header)
+        '''
+        entry = self.find(typecode, resid, stream)
+        if entry is None:
+            return self.open(ResourceQuery(typecode, resid), stream)
+        stream.seek(entry.offset)
+        header = read_resource_header_from_stream(stream)
+        return open_subfile(stream, entry.offset, header.size)
+
+    def iter_many(self, resources, stream):
+        '''
+        Reads many resources at once. The resources are read in order of their
+        offsets and neighbouring resources are read with a single read (see
+        fileiocommon.iter_ranges). The reads are planned with the offsets in the
+        resource map, so no resource headers have to be read beforehand. Resources
+        missing in the map are searched like in open_resource and read afterwards.
+
+        @param resources iterable of tuples (typecode, id)
+        @param stream see open
+        @return generator of tuples ((typecode, id), memoryview of resource data including header)
+        '''
+        ranges = []
+        offsets = {}
+        missing = []
+        for key in resources:
+            entry = self.find(key[0], key[1], stream)
+            if entry is None:
+                missing.append(key)
+            else:
+                offsets[key] = entry.offset
+                ranges.append((key, entry.offset, self.__planned_size(entry.offset, stream)))
+        for key, data in iter_ranges(stream, ranges):
+            #a size derived from the resource map may include unmapped data like XXXX filler,
+            #the header knows better
+            typecode_buf, size, resid, flags = _resource_header.unpack_from(data)
+            self.__header_sizes[offsets[key]] = size
+            if size > len(data): #resource overlaps the next one in the map
+                stream.seek(offsets[key])
+                data = memoryview(stream.read(size))
+            yield key, data[:size]
+        for key in missing:
+            resfile = self.open(ResourceQuery(key[0], key[1]), stream)
+            yield key, memoryview(resfile.read())
+
+    def read_many(self, resources, stream):
+        '''
+        see iter_many
+
+        @return dict (typecode, id) -> bytes
+        '''
+        return dict((key, bytes(data)) for key, data in self.iter_many(resources, stream))
 
     def glob(self, stream):
         '''
@@ -247,26 +541,165 @@ class IffFile(object):
             #read content of GLOB resource
             data = stream.read(header.size - IffResourceHeader.length)
             if data.find(b'\0') != -1:
-                logger.debug("Assuming GLOB resource contains zero-terminated string")
                 #assume zero-terminated string
-                semiglobal_buf = read_zero_zerminated_string(BytesIO(data))
+                semiglobal_buf = BufferCursor(data).read_zero_terminated_string()
             elif data[0] < 32:
-                logger.debug("Assuming GLOB resource contains pascal-style string")
                 #assume pascal-style string
-                semiglobal_buf = read_pascal_style_string(BytesIO(data))
+                semiglobal_buf = BufferCursor(data).read_pascal_style_string()
             else:
-                logger.debug("Assuming GLOB resource contains raw string")
                 #assume raw string
                 semiglobal_buf = data
 
             return semiglobal_buf.decode('ascii')
 
+        if not self.resource_map_loaded and self.rsmp_offset != 0:
+            #the resource map resource is read completely, but only the GLOB type list is kept
+            globs = self.__read_resource_map(stream, ("GLOB",))
+            if len(globs) > 0:
+                stream.seek(globs[0].offset)
+                return read_glob_from_stream(stream)
+
         try:
-            globfile = self.open(lambda header: header.typecode == "GLOB", stream)
+            globfile = self.open(ResourceQuery("GLOB"), stream)
         except NoMatchingIffResourceFound:
             return None
         return read_glob_from_stream(globfile)
 
+    def scan(self, stream):
+        '''
+        Reads all resource headers present in the file, independent of the resource map.
+        The sizes found are remembered and used by resource_extents, open and iter_open
+        instead of the sizes derived from the resource map.
+
+        @return ResourceHeaderTable, see scan_resource_headers
+        '''
+        table = scan_resource_headers(stream, self.start)
+        self.__header_sizes.update(zip(table.offsets, table.sizes))
+        return table
+
+    def __derive_sizes(self, stream):
+        '''
+        Derives the sizes of all resources in the resource map from the sorted
+        offsets of the resources, the resource map itself and the end of the file:
+        A resource is taken to end where the next one starts.
+
+        A derived size is not exact if the resource is followed by something
+        outside the map (the resource map itself or the end of the file, which
+        may be preceded by a "dummy tail", see iter_open), if it is XXXX filler
+        or if it is too small for a resource header.
+
+        @return dict offset -> (size, exact)
+        '''
+        if self.__sizes is None:
+            table = self.resource_map
+            mapped_offsets = set(table.offsets)
+            boundaries = set(mapped_offsets)
+            boundaries.add(stream.seek(0, SEEK_END))
+            if self.rsmp_offset != 0:
+                boundaries.add(self.rsmp_offset)
+            boundaries = sorted(boundaries)
+            filler_offsets = set(row.offset for row in self.query(ResourceQuery("XXXX")))
+            sizes = {}
+            for offset, next_offset in zip(boundaries, boundaries[1:]):
+                if offset in mapped_offsets:
+                    size = next_offset - offset
+                    sizes[offset] = (size, next_offset in mapped_offsets and size >= IffResourceHeader.length
+                                           and offset not in filler_offsets)
+            for offset in mapped_offsets - set(sizes): #offsets at or behind the end of the file
+                sizes[offset] = (0, False)
+            self.__sizes = sizes
+        return self.__sizes
+
+    def __planned_size(self, offset, stream):
+        '''
+        @return number of bytes to read for the resource at offset, at least its complete header
+        '''
+        size = self.__header_sizes.get(offset)
+        if size is None:
+            size = self.__derive_sizes(stream)[offset][0]
+            if size < IffResourceHeader.length:
+                size = self.__resource_size(offset, stream)
+        return size
+
+    def __resource_size(self, offset, stream):
+        '''
+        @return size of the resource at offset. The size is taken from the header if
+                it was read before (see scan), else derived from the resource map
+                (see __derive_sizes). The header is only read if the derived size
+                is not exact
+        '''
+        size = self.__header_sizes.get(offset)
+        if size is None:
+            size, exact = self.__derive_sizes(stream)[offset]
+            if not exact:
+                stream.seek(offset)
+                size = self.__header_sizes[offset] = read_resource_header_from_stream(stream).size
+        return size
+
+    def resource_extents(self, predicate, stream):
+        '''
+        Batch lookup of the positions of all resources in the resource map
+        matching predicate.
+
+        The sizes are derived from the offsets in the resource map (the next
+        resource starts where a resource ends), so no resource headers have
+        to be read. Only resources followed by something not listed in the map
+        (the resource map itself, the end of the file) and XXXX filler are
+        validated by reading their headers. If the headers were walked before
+        (see scan) or the resources were read with iter_many, the sizes found
+        there are used.
+
+        Note that a derived size includes any data not listed in the map which
+        follows the resource, like unmapped XXXX filler. The header inside the
+        resource always holds the exact size; call scan before to get exact
+        sizes at the cost of walking all headers once.
+
+        @param predicate ResourceQuery, any predicate accepted by open or None for all resources
+        @return list of tuples (offset, size) in resource map order, size includes the resource header
+        '''
+        self.__require_resource_map(stream)
+        if self.resource_map is None:
+            return []
+        if predicate is None:
+            rows = self.resource_map
+        elif isinstance(predicate, ResourceQuery):
+            rows = self.query(predicate)
+        else:
+            rows = [row for row in self.resource_map if predicate(row)]
+        return [(row.offset, self.__resource_size(row.offset, stream)) for row in rows]
+
+    def resource_map_is_stale(self, stream):
+        '''
+        Cheap validation of the resource map: Checks that the first resource
+        known from the map (or the resource map itself) starts where the
+        resource entries start and that the last one ends at the end of the
+        file. This detects resources added to the beginning or the end of the
+        file without updating the resource map, reading a single header.
+        The result is remembered.
+
+        @return True if the resource map does not describe the file completely
+        '''
+        self.__require_resource_map(stream)
+        if self.resource_map is None:
+            return True
+        if self.__map_is_stale is None:
+            offsets = list(self.resource_map.offsets)
+            if self.rsmp_offset != 0:
+                offsets.append(self.rsmp_offset)
+            if not offsets:
+                self.__map_is_stale = True
+                return True
+            end_of_file_off = stream.seek(0, SEEK_END)
+            last = max(offsets)
+            stale = min(offsets) != self.start or last > end_of_file_off - IffResourceHeader.length
+            if not stale:
+                stream.seek(last)
+                header = read_resource_header_from_stream(stream)
+                #see iter_open concerning the "dummy tail"
+                stale = not (end_of_file_off - IffResourceHeader.length <= last + header.size <= end_of_file_off)
+            self.__map_is_stale = stale
+        return self.__map_is_stale
+
     def open(self, predicate, stream):
         '''
         @return file-like object accessing resource data (including resource header)
@@ -285,55 +718,63 @@ class IffFile(object):
         except StopIteration:
             raise NoMatchingIffResourceFound()
 
-    def iter_open(self, predicate, stream):
+    def iter_open(self, predicate, stream, rescan=None):
         '''
         Works like open but does find all matches for predicate.
         Opens each with the same stream
+
+        @param predicate see open. If predicate is a ResourceQuery, the
+                         resource map is searched using its index
+        @param rescan RESCAN_ALWAYS, RESCAN_NEVER or RESCAN_LAZY, whether the resource headers
+                      in the file are walked after the resource map was searched. If None,
+                      the mode given on creation of the IffFile object is used.
+                      Note that the resource map does not list itself, so the 'rsmp' resource
+                      is only found by walking the headers.
         '''
+        if rescan is None:
+            rescan = self.rescan
+        self.__require_resource_map(stream)
 
         #If a resource map is present, we first search in there
-        rsmp_matches = []   #we remember the matches we found in the resource map so
-                            #we can skip them while we traverse the other resources
-                            #manually...
+        rsmp_matches = set()    #we remember the matches we found in the resource map so
+                                #we can skip them while we traverse the other resources
+                                #manually...
         if self.resource_map != None:
-            for entry in self.resource_map:
+            if isinstance(predicate, ResourceQuery):
+                candidates = self.query(predicate)
+            else:
+                candidates = self.resource_map
+            for entry in candidates:
                 assert not stream.closed #User must not close the stream during yield
                 if predicate(entry) == True:
-                    #read header of entry to determine size
-                    stream.seek(entry.offset)
-                    header = read_resource_header_from_stream(stream)
-                    rsmp_matches.append(entry.offset)
-                    newsfile = SubFile(stream, entry.offset, header.size)
+                    #the size is derived from the resource map, see resource_extents
+                    rsmp_matches.add(entry.offset)
+                    newsfile = open_subfile(stream, entry.offset, self.__resource_size(entry.offset, stream))
                     yield newsfile
 
+            if rescan == RESCAN_NEVER:
+                return
+            if rescan == RESCAN_LAZY and not self.resource_map_is_stale(stream):
+                return
+
         #Now we try to manually find the resource by iterating
-        #over the actual resource headers (slow due to file access)
-
-        #determine length of IFF file
-        stream.seek(0, SEEK_END)
-        end_of_file_off = stream.tell()
-        #run through all entries until we reach end_of_file_off
-        stream.seek(self.start, SEEK_SET)
-        #the -76 is to skip any "dummy tail" in the archive. For example, in Persons\Bones.iff from Objects.far,
+        #over the actual resource headers (see scan_resource_headers)
+
+        #scan_resource_headers skips any "dummy tail" in the archive. For example, in Persons\Bones.iff from Objects.far,
         #the last valid IFF resource ends one byte before the end of the file. 76 is the size of a IFF resource
         #header and therefore the minimum space an IFF resource requires. If we are closer to the end of the file,
         #we consider the rest of the data as dummy tail and skip it
-        while stream.tell() < end_of_file_off-76:
+        for header in self.scan(stream):
             assert not stream.closed #User must not close the stream during yield
-            resstart = stream.tell()
-            header = read_resource_header_from_stream(stream)
-            if resstart in rsmp_matches: #resource was yielded already from resource map search
-                stream.seek(resstart+header.size, SEEK_SET) #skip
+            if header.offset in rsmp_matches: #resource was yielded already from resource map search
                 continue
             elif predicate(header) == True:
-                yield SubFile(stream, resstart, header.size)
-            stream.seek(resstart+header.size, SEEK_SET) #jump to next resource entry
-
-        raise StopIteration
+                yield open_subfile(stream, header.offset, header.size)
 
 from os.path import join
+from .extraction import physical_file_location, extract_ranges
 
-def extract_iff(stream, output_path):
+def extract_iff(stream, output_path, max_workers=None):
     '''
     Creates file for every iff entry in output_path
 
@@ -341,23 +782,38 @@ def extract_iff(stream, output_path):
     <typecode>_<name or id>
 
     Because some iff entries contain "/", it is substituted for "\"
+
+    If stream is a physical file or a subrange of one, the resources are
+    copied in parallel and in order of their offsets in the file (see
+    extraction.py)
+
+    @param max_workers number of threads used for copying
     '''
+    def generic_filename(header):
+        '''
+        Determine filename for extracted IFF resource if user has not explicitely given a filename
+        '''
+        if header.name == "":
+            return header.typecode + "_" + str(header.resid)
+        else:
+            return header.typecode + "_" + header.name.replace("/","\\")
+
     ff = IffFile(stream)
+    location = physical_file_location(stream)
+    jobs = []
     for entrystream in ff.iter_open(lambda p: True, stream):
         header = read_resource_header_from_stream(entrystream)
         #The header is already read from the stream, so it is NOT put into the output file
         #This is INTENDED
-        def generic_filename(header):
-            '''
-            Determine filename for extracted IFF resource if user has not explicitely given a filename
-            '''
-            if header.name == "":
-                return header.typecode + "_" + str(header.resid)
-            else:
-                return header.typecode + "_" + header.name.replace("/","\\")
-
+        if location is not None:
+            #entrystream is a subrange of the same physical file as stream (see open_subfile)
+            jobs.append((entrystream.base_offset + IffResourceHeader.length, header.size - IffResourceHeader.length,
+                         join(output_path, generic_filename(header))))
+            continue
         with open(join(output_path, generic_filename(header)), "wb") as fp:
-            fp.write(entrystream.read())
+            fp.write(entrystream.read(header.size - IffResourceHeader.length))
+    if location is not None:
+        extract_ranges(location[0], jobs, max_workers)
 
 #Command-line utility
 if __name__ == "__main__":
@@ -421,11 +877,10 @@ if __name__ == "__main__":
 
 #Testcode
 
-logger.addHandler(logging.StreamHandler())
-logger.setLevel(logging.DEBUG)
-
-from .gamedata_for_tests import requires_known_iff_file
+from .gamedata_for_tests import requires_known_iff_file, make_iff_file, make_iff_resource
 import os
+import io
+import tempfile
 
 try:
     from nose.tools import assert_raises
@@ -458,6 +913,188 @@ try:
             header = read_resource_header_from_stream(resfile)
             assert e['size'] == header.size
 
+    @requires_known_iff_file
+    def test_query_resource_map_index(known_iff_file):
+        stream = open(known_iff_file.filename, "rb")
+        ifffile = IffFile(stream)
+        for typelist in known_iff_file.rsmp["typelists"]:
+            for e in typelist["entries"]:
+                entry = ifffile.find(typelist["typecode"], e["id"])
+                assert (entry.offset, entry.name) == (e["offset"], e["name"])
+        assert ifffile.find("BHAV", 1) is None
+        bhavs = ifffile.query(ResourceQuery("BHAV", range(4096, 4099)))
+        assert sorted(entry.resid for entry in bhavs) == [4096, 4097, 4098]
+        assert len(ifffile.query(ResourceQuery(flags_mask=16, flags=0))) == 2
+        assert [entry.resid for entry in ifffile.query(ResourceQuery(name="speech_*"))] == [2005, 2006]
+        resfile = ifffile.open_resource("BMP_", 2004, stream)
+        header = read_resource_header_from_stream(resfile)
+        assert (header.typecode, header.resid, header.size) == ("BMP_", 2004, 2030)
+        assert len(list(ifffile.iter_open(ResourceQuery("BMP_"), stream))) == 6
+
+    @requires_known_iff_file
+    def test_resource_map_table_select(known_iff_file):
+        from . import tables
+        table = IffFile(open(known_iff_file.filename, "rb")).resource_map
+        queries = [ResourceQuery(), ResourceQuery("STR#"), ResourceQuery(resid=range(2000, 2010, 2)),
+                   ResourceQuery(flags_mask=16, flags=16), ResourceQuery(name="speech_*"), ResourceQuery("NONE")]
+        numpy = tables.numpy
+        try:
+            for query in queries:
+                expected = [row.index for row in table if query(row)]
+                assert table.select(query) == expected
+                tables.numpy = None
+                assert table.select(query) == expected
+                tables.numpy = numpy
+        finally:
+            tables.numpy = numpy
+
+    @requires_known_iff_file
+    def test_instrumentation(known_iff_file):
+        spans = []
+        instr = instrumentation.enable(on_span=lambda name, seconds: spans.append(name))
+        try:
+            ifffile = IffFile(open(known_iff_file.filename, "rb"))
+            assert instr.snapshot()["counters"]["headers_parsed"] == 1 #the header of the resource map
+            stream = open(known_iff_file.filename, "rb")
+            for resfile in ifffile.iter_open(ResourceQuery("BMP_"), stream, rescan=RESCAN_NEVER):
+                resfile.read()
+            #the sizes of the bitmaps are derived from the resource map, no headers are parsed
+            assert instr.snapshot()["counters"]["headers_parsed"] == 1
+            ifffile.resource_extents(None, stream)
+            #only the last resource is validated, it may be followed by a "dummy tail"
+            assert instr.snapshot()["counters"]["headers_parsed"] == 2
+        finally:
+            assert instrumentation.disable() is instr
+        stats = instr.snapshot()
+        assert stats["counters"]["bytes_read"] > 0
+        assert stats["calls"]["iff.IffFile"] == 1 and stats["calls"]["iff.read_resource_map"] == 1
+        assert "iff.IffFile" in spans
+        IffFile(open(known_iff_file.filename, "rb"))
+        assert instr.snapshot()["calls"]["iff.IffFile"] == 1
+
+    @requires_known_iff_file
+    def test_lazy_iff_file(known_iff_file):
+        class CountingStream(object):
+            def __init__(self, stream):
+                self.stream = stream
+                self.bytes_read = 0
+            def read(self, size=-1):
+                data = self.stream.read(size)
+                self.bytes_read += len(data)
+                return data
+            def readinto(self, b):
+                num = self.stream.readinto(b)
+                self.bytes_read += num
+                return num
+            def __getattr__(self, name):
+                return getattr(self.stream, name)
+        stream = CountingStream(open(known_iff_file.filename, "rb"))
+        ifffile = IffFile(stream, lazy=True)
+        assert not ifffile.resource_map_loaded and stream.bytes_read == 64
+        assert ifffile.glob(stream) == known_iff_file.glob
+        assert not ifffile.resource_map_loaded
+        assert stream.bytes_read == 64 + 484 + 332 #signature, resource map and GLOB resource
+        assert_raises(IOError, ifffile.find, "BMP_", 2004)
+        assert ifffile.find("BMP_", 2004, stream).offset == 39566
+        assert ifffile.resource_map_loaded
+
+    @requires_known_iff_file
+    def test_resource_extents(known_iff_file):
+        ifffile = IffFile(open(known_iff_file.filename, "rb"))
+        stream = open(known_iff_file.filename, "rb")
+        sizes = dict(((e["typecode"], e["id"]), e["size"]) for e in known_iff_file.contents)
+        expected = [(row.offset, sizes[(row.typecode, row.resid)]) for row in ifffile.resource_map]
+        assert ifffile.resource_extents(None, stream) == expected
+        assert ifffile.resource_extents(ResourceQuery("BHAV", 4100), stream) == [(1786, 340)]
+        ifffile.scan(stream)
+        assert ifffile.resource_extents(lambda row: True, stream) == expected
+
+    @requires_known_iff_file
+    def test_read_many(known_iff_file):
+        ifffile = IffFile(open(known_iff_file.filename, "rb"))
+        stream = open(known_iff_file.filename, "rb")
+        keys = [("GLOB", 128), ("BMP_", 2004), ("BHAV", 4096), ("BHAV", 4097), ("rsmp", 0)]
+        expected = dict((key, ifffile.open(ResourceQuery(*key), stream).read()) for key in keys)
+        assert ifffile.read_many(keys, stream) == expected
+        assert_raises(NoMatchingIffResourceFound, ifffile.read_many, [("BHAV", 1)], stream)
+
+    @requires_known_iff_file
+    def test_rescan_modes(known_iff_file):
+        everything = lambda header: True
+        stream = open(known_iff_file.filename, "rb")
+        num_resources = len(list(IffFile(stream).iter_open(everything, stream)))
+        #the map does not list the rsmp resource itself
+        stream = open(known_iff_file.filename, "rb")
+        assert len(list(IffFile(stream, rescan=RESCAN_NEVER).iter_open(everything, stream))) == num_resources - 1
+        stream = open(known_iff_file.filename, "rb")
+        ifffile = IffFile(stream, rescan=RESCAN_LAZY)
+        assert not ifffile.resource_map_is_stale(stream)
+        assert len(list(ifffile.iter_open(everything, stream))) == num_resources - 1
+        assert len(list(ifffile.iter_open(everything, stream, rescan=RESCAN_ALWAYS))) == num_resources
+
+    @requires_known_iff_file
+    def test_scan_resource_headers(known_iff_file):
+        stream = open(known_iff_file.filename, "rb")
+        ifffile = IffFile(stream)
+        table = ifffile.scan(stream)
+        headers = []
+        for row in table:
+            stream.seek(row.offset)
+            headers.append(vars(read_resource_header_from_stream(stream)))
+        assert headers == [{"typecode": row.typecode, "size": row.size, "resid": row.resid, "flags": row.flags, "name": row.name}
+                           for row in scan_resource_headers(stream, ifffile.start, chunk_size=100)]
+        for e in known_iff_file.contents:
+            assert any((row.typecode, row.resid, row.size, row.name) == (e["typecode"], e["id"], e["size"], e["name"]) for row in table)
+
+    @requires_known_iff_file
+    def test_extract_iff(known_iff_file):
+        with open(known_iff_file.filename, "rb") as fp:
+            data = fp.read()
+        stream = io.BytesIO(data)
+        ifffile = IffFile(stream)
+        #copying from the physical file in parallel and reading from a stream in memory
+        for source in (open(known_iff_file.filename, "rb"), io.BytesIO(data)):
+            with tempfile.TemporaryDirectory() as output_path:
+                extract_iff(source, output_path, max_workers=4)
+                assert len(os.listdir(output_path)) == len(known_iff_file.contents) - 12 #contents lists the 6 bitmaps three times
+                for resfile in ifffile.iter_open(lambda header: True, stream):
+                    header = read_resource_header_from_stream(resfile)
+                    filename = header.typecode + "_" + (header.name.replace("/", "\\") or str(header.resid))
+                    with open(os.path.join(output_path, filename), "rb") as fp:
+                        assert fp.read() == resfile.read(header.size - IffResourceHeader.length)
+
+    def test_query_names_with_shared_pool():
+        from .tables import StringPool
+        pool = StringPool()
+        objects = make_iff_file([("BHAV", 4096, 16, "Main", b"b"*20), ("BHAV", 4097, 16, "init", b"i"*20)])
+        person = make_iff_file([("BHAV", 4096, 16, "Main loop", b"m"*20), ("STR#", 300, 0, "Maintenance", b"s"*20)])
+        ifffile = IffFile(io.BytesIO(objects), pool=pool)
+        IffFile(io.BytesIO(person), pool=pool)
+        assert [(row.typecode, row.name) for row in ifffile.query(ResourceQuery(name="Main*"))] == [("BHAV", "Main")]
+        assert ifffile.query(ResourceQuery("STR#", name="Main*")) == []
+
+    def test_unmapped_data_between_resources():
+        resources = [("STR#", 300, 0, "strings", b"s"*10), ("XXXX", 0, 0, "", b"\0"*96),
+                     ("BHAV", 4096, 16, "Main", b"b"*20), ("BHAV", 4097, 16, "next", b"n"*4)]
+        stream = io.BytesIO(make_iff_file(resources, tail=b"\0"))
+        ifffile = IffFile(stream)
+        #read_many trims the planned reads to the sizes in the headers
+        assert ifffile.read_many([("BHAV", 4097), ("STR#", 300)], stream) == {
+            ("STR#", 300): make_iff_resource(*resources[0]), ("BHAV", 4097): make_iff_resource(*resources[3])}
+        stream.seek(0)
+        ifffile = IffFile(stream)
+        #the size derived from the map includes the unmapped filler, the header knows better
+        resfile = ifffile.open(ResourceQuery("STR#"), stream)
+        assert read_resource_header_from_stream(resfile).size == 86
+        assert ifffile.resource_extents(None, stream) == list(zip(ifffile.resource_map.offsets, [86 + 172, 96, 80]))
+        ifffile.scan(stream)
+        assert ifffile.resource_extents(None, stream) == list(zip(ifffile.resource_map.offsets, [86, 96, 80]))
+        assert [len(resfile.read()) for resfile in ifffile.iter_open(ResourceQuery(), stream, rescan=RESCAN_NEVER)] == [86, 96, 80]
+        #mapped filler is validated
+        stream = io.BytesIO(make_iff_file(resources, unmapped=(), tail=b"\0"))
+        ifffile = IffFile(stream)
+        assert ifffile.resource_extents(None, stream) == list(zip(ifffile.resource_map.offsets, [86, 172, 96, 80]))
+
     #stream = open(os.path.join("PySims/TheSims_official_gamedata", "UserData2", "Houses", "House00.iff"), "rb")
     #ifffile = IffFile(stream)
     #for bmpfile in ifffile.iter_open(lambda header: True, stream):
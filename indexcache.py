@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+Persistent cache for the indices of FAR and IFF files
+
+Parsing the manifest of a FAR file or the resource map of an IFF file
+requires a lot of small reads. The IndexCache stores the parsed data
+in a compact binary file, either as a sidecar file next to the archive
+or inside a dedicated cache directory, and loads it back on the next
+start.
+
+A cache file is only used if path, size, modification time and a hash
+over the first bytes of the archive still match. Otherwise the archive
+is parsed again and the cache file is rewritten.
+
+Cache file layout (all numbers little-endian):
+    magic            b"PySimsIdx"
+    format version   uint8
+    kind             uint8 (0 = FAR, 1 = IFF)
+    size             uint64 size of the archive
+    mtime            int64  modification time of the archive in ns
+    header hash      20 bytes, sha1 over the first 4096 bytes of the archive
+    path             uint16 length + utf-8 encoded absolute path of the archive
+    payload          see _pack_far_entries and _pack_iff_resource_map
+'''
+
+import os
+import struct
+import hashlib
+
+from .far import FarFile
+from .iff import IffFile
+from .tables import FarManifestTable, ResourceMapTable
+
+magic = b"PySimsIdx"
+format_version = 2
+sidecar_suffix = ".pysimsidx"
+header_hash_size = 4096
+
+KIND_FAR = 0
+KIND_IFF = 1
+
+_cache_header = struct.Struct("<BBQq20sH")
+_far_entry = struct.Struct("<IIIH")
+_iff_start = struct.Struct("<IIBI")
+_iff_entry = struct.Struct("<4sIHIH")
+
+def _pack_far_entries(farfile):
+    entries = list(farfile.entries)
+    chunks = [struct.pack("<I", len(entries))]
+    for entry in entries:
+        name = entry.filename.encode("utf-8")
+        chunks.append(_far_entry.pack(entry.off, entry.len1, entry.len2, len(name)))
+        chunks.append(name)
+    return b"".join(chunks)
+
+def _unpack_far_entries(data, pos):
+    num_entries, = struct.unpack_from("<I", data, pos)
+    pos += 4
+    entries = FarManifestTable()
+    for i in range(num_entries):
+        off, len1, len2, name_len = _far_entry.unpack_from(data, pos)
+        pos += _far_entry.size
+        filename = data[pos:pos+name_len].decode("utf-8")
+        pos += name_len
+        entries.append(filename, off, len1, len2)
+    return FarFile.from_entries(entries)
+
+def _pack_iff_resource_map(ifffile):
+    resource_map = ifffile.resource_map
+    if resource_map is None:
+        return _iff_start.pack(ifffile.start, ifffile.rsmp_offset, 0, 0)
+    chunks = [_iff_start.pack(ifffile.start, ifffile.rsmp_offset, 1, len(resource_map))]
+    for entry in resource_map:
+        name = entry.name.encode("utf-8")
+        chunks.append(_iff_entry.pack(entry.typecode.encode("ascii"), entry.offset, entry.resid, entry.flags, len(name)))
+        chunks.append(name)
+    return b"".join(chunks)
+
+def _unpack_iff_resource_map(data, pos):
+    start, rsmp_offset, has_map, num_entries = _iff_start.unpack_from(data, pos)
+    pos += _iff_start.size
+    if not has_map:
+        return IffFile.from_resource_map(start, None, rsmp_offset)
+    resource_map = ResourceMapTable()
+    for i in range(num_entries):
+        typecode, offset, resid, flags, name_len = _iff_entry.unpack_from(data, pos)
+        pos += _iff_entry.size
+        name = data[pos:pos+name_len].decode("utf-8")
+        pos += name_len
+        resource_map.append(typecode.decode("ascii"), offset, resid, flags, name)
+    return IffFile.from_resource_map(start, resource_map, rsmp_offset)
+
+class IndexCache(object):
+    '''
+    Creates FarFile and IffFile objects for physical files, using
+    cached indices where possible.
+
+    Writing a cache file is best-effort: If the cache location is
+    not writable, the archive is simply parsed each time.
+    '''
+    def __init__(self, cache_dir=None):
+        '''
+        @param cache_dir directory to store the cache files in. If None, cache files are stored
+                         as sidecar files next to the archives (<archive>.pysimsidx)
+        '''
+        self.cache_dir = cache_dir
+
+    def cache_filename(self, path):
+        '''
+        @return filename of the cache file for archive path
+        '''
+        if self.cache_dir is None:
+            return path + sidecar_suffix
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + sidecar_suffix)
+
+    def far_file(self, path):
+        '''
+        @return FarFile object for the FAR file at path
+        '''
+        return self.__load(path, KIND_FAR, FarFile, _pack_far_entries, _unpack_far_entries)
+
+    def iff_file(self, path):
+        '''
+        @return IffFile object for the IFF file at path
+        '''
+        return self.__load(path, KIND_IFF, IffFile, _pack_iff_resource_map, _unpack_iff_resource_map)
+
+    def invalidate(self, path):
+        '''
+        Removes the cache file for archive path, if there is one
+        '''
+        try:
+            os.remove(self.cache_filename(path))
+        except FileNotFoundError:
+            pass
+
+    def __load(self, path, kind, cls, pack, unpack):
+        with open(path, "rb") as stream:
+            stat = os.fstat(stream.fileno())
+            header_hash = hashlib.sha1(stream.read(header_hash_size)).digest()
+            abspath = os.path.abspath(path).encode("utf-8")
+            key = _cache_header.pack(format_version, kind, stat.st_size, stat.st_mtime_ns, header_hash, len(abspath)) + abspath
+
+            cache_filename = self.cache_filename(path)
+            try:
+                with open(cache_filename, "rb") as fp:
+                    data = fp.read()
+            except OSError:
+                data = None
+            if data is not None and data.startswith(magic + key):
+                try:
+                    return unpack(data, len(magic) + len(key))
+                except (struct.error, UnicodeDecodeError):
+                    pass #damaged cache file, rebuild it
+
+            stream.seek(0)
+            archive = cls(stream)
+
+        tmp_filename = cache_filename + ".%d.tmp" % os.getpid()
+        try:
+            with open(tmp_filename, "wb") as fp:
+                fp.write(magic + key + pack(archive))
+            os.replace(tmp_filename, cache_filename)
+        except OSError:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+        return archive
+
+#Testcode
+
+from .gamedata_for_tests import requires_known_farfile, requires_known_iff_file
+import tempfile
+
+@requires_known_farfile
+def test_far_file_from_cache(known_far_file):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = IndexCache(cache_dir)
+        farfile = cache.far_file(known_far_file.filename)
+        assert os.path.exists(cache.cache_filename(known_far_file.filename))
+        cached = cache.far_file(known_far_file.filename)
+        assert list(cached.filenames) == list(farfile.filenames)
+        for fname, (len1, len2, off) in known_far_file.contents.items():
+            entry = cached.get_entry(fname)
+            assert (entry.len1, entry.len2, entry.off) == (len1, len2, off)
+
+@requires_known_iff_file
+def test_iff_file_from_cache(known_iff_file):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = IndexCache(cache_dir)
+        ifffile = cache.iff_file(known_iff_file.filename)
+        cached = cache.iff_file(known_iff_file.filename)
+        assert cached.start == ifffile.start
+        as_tuple = lambda e: (e.typecode, e.offset, e.resid, e.flags, e.name)
+        assert [as_tuple(e) for e in cached.resource_map] == [as_tuple(e) for e in ifffile.resource_map]
+        with open(known_iff_file.filename, "rb") as stream:
+            assert cached.glob(stream) == known_iff_file.glob
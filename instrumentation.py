@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+Opt-in instrumentation of the readers
+
+Instrumentation is disabled by default. Then the module global active is
+None and every call site only checks for that, nothing is counted or
+timed:
+
+    if instrumentation.active is not None:
+        instrumentation.active.count("bytes_read", len(data))
+
+enable() installs an Instrumentation object which collects
+
+    counters  bytes_read      bytes read from underlying streams and files
+              seeks           repositionings of underlying streams
+              headers_parsed  IFF resource headers parsed
+              cache_hits      blocks served by a subfile.BlockCache
+              cache_misses    blocks fetched by a subfile.BlockCache
+    timings   accumulated wall time and number of calls per parser, e.g.
+              "iff.IffFile" or "bcf.read_characterdata"
+
+Optionally, every timed section (span) is reported to a callback, so
+the values can be fed into other metric systems.
+'''
+
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+active = None #Instrumentation object if enabled, else None
+
+class Instrumentation(object):
+    '''
+    Collects counters and timings. All methods may be called from
+    several threads.
+    '''
+    def __init__(self, on_span=None):
+        '''
+        @param on_span callable(name, seconds) called after every span, or None
+        '''
+        self.on_span = on_span
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.timings = defaultdict(float) #name -> accumulated seconds
+            self.calls = defaultdict(int)     #name -> number of spans
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record(self, name, seconds):
+        '''
+        Adds a measured duration to the timing of name
+        '''
+        with self.lock:
+            self.timings[name] += seconds
+            self.calls[name] += 1
+        if self.on_span is not None:
+            self.on_span(name, seconds)
+
+    def span(self, name):
+        '''
+        @return context manager measuring the wall time of its body as timing of name
+        '''
+        return _Span(self, name)
+
+    def snapshot(self):
+        '''
+        @return dict with copies of counters, timings and calls
+        '''
+        with self.lock:
+            return {"counters": dict(self.counters), "timings": dict(self.timings), "calls": dict(self.calls)}
+
+class _Span(object):
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start)
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_span = _NullSpan()
+
+def enable(on_span=None):
+    '''
+    Starts collecting counters and timings in a new Instrumentation object
+
+    @param on_span see Instrumentation
+    @return the Instrumentation object
+    '''
+    global active
+    active = Instrumentation(on_span)
+    return active
+
+def disable():
+    '''
+    Stops collecting
+
+    @return the Instrumentation object used so far or None
+    '''
+    global active
+    instrumentation, active = active, None
+    return instrumentation
+
+def span(name):
+    '''
+    Times a section of code if instrumentation is enabled, e.g.
+
+        with instrumentation.span("myapp.load_lot"):
+            ...
+
+    @return context manager
+    '''
+    if active is None:
+        return _null_span
+    return active.span(name)
+
+def timed(name):
+    '''
+    Decorator timing each call of a parser function as span name
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return func(*args, **kwargs)
+            with active.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
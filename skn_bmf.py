@@ -23,6 +23,7 @@ compressed versions of SKN files. See datastream.py
 '''
 
 from .datastream import TextDataStream, BinaryDataStream
+from . import instrumentation
 
 class DeformableMesh(object):
     '''
@@ -34,15 +35,21 @@ class DeformableMesh(object):
         self.texfilename = texfilename          # basename of texture file
         self.bones = bones                      # bone indices used
         self.faces = faces                      # 3-tuples of indices into the vertices list
+                                                # (this and the following lists are flat arrays if read with as_arrays=True)
         self.bonebindings = bonebindings        # specification which vertices are bound to which bone with a weight of 1.0. bones are denoted by their index in bones list
                                                 # Important: The list is sorted for the bone idx. So bonebindings[i] is the binding for the bone of index i
         self.uvcoords = uvcoords                # uv coordinates for the vertices
         self.blenddata = blenddata              # (optional) weight specification for vertices
         self.vertices = vertices                # vertex coordinates are relative to their primary bone (propably the one they are bound to unblendedly)11
 
-def read_deformablemesh_from_stream(stream):
+@instrumentation.timed("bmf.read_deformablemesh")
+def read_deformablemesh_from_stream(stream, as_arrays=False):
     '''
     @param stream Datastream
+    @param as_arrays if True, faces, bonebindings, uvcoords, blenddata and vertices are
+                     not returned as lists of tuples but each as one flat array.array read
+                     at once (e.g. faces as [a0, b0, c0, a1, b1, c1, ...]), see
+                     BinaryDataStream.read_int_array
 
     Reads Mesh from SKN/BMF stream.
     Does NOT automatically determine whether this is a text or a binary stream!
@@ -51,6 +58,13 @@ def read_deformablemesh_from_stream(stream):
 
     See http://simtech.sourceforge.net/tech/file_formats_skn.htm
     '''
+    def read_records(read_array, width):
+        num = stream.read_int()
+        values = read_array(num, width)
+        if as_arrays:
+            return values
+        return [tuple(values[i:i+width]) for i in range(0, len(values), width)]
+
     name = stream.read_str()
     texfilename = stream.read_str()
 
@@ -60,30 +74,11 @@ def read_deformablemesh_from_stream(stream):
     for i in range(num_bones):
         bones.append(stream.read_str())
 
-    num_faces = stream.read_int()
-    faces = []
-    for i in range(num_faces):
-        faces.append(stream.read_ints(3))
-
-    num_bonebindings = stream.read_int()
-    bonebindings = []
-    for i in range(num_bonebindings):
-        bonebindings.append(stream.read_ints(5))
-
-    num_uvcoords = stream.read_int()
-    uvcoords = []
-    for i in range(num_uvcoords):
-        uvcoords.append(stream.read_floats(2))
-
-    num_blenddata = stream.read_int()
-    blenddata = []
-    for i in range(num_blenddata):
-        blenddata.append(stream.read_ints(2))
-
-    num_vertices = stream.read_int()
-    vertices = []
-    for i in range(num_vertices):
-        vertices.append(stream.read_floats(6))
+    faces = read_records(stream.read_int_array, 3)
+    bonebindings = read_records(stream.read_int_array, 5)
+    uvcoords = read_records(stream.read_float_array, 2)
+    blenddata = read_records(stream.read_int_array, 2)
+    vertices = read_records(stream.read_float_array, 6)
 
     return DeformableMesh(name, texfilename, bones, faces, bonebindings, uvcoords, blenddata, vertices)
 
@@ -95,3 +90,37 @@ def test_smoketest_germ_skn():
     skn_filepath = os.path.join("TheSims_official_gamedata", "GameData", "Skins", "xskin-c027fa_germ-HEAD-HEAD.skn")
     with open(skn_filepath, "rb") as f:
         data = read_deformablemesh_from_stream(TextDataStream(f))
+
+def test_read_bmf_as_arrays():
+    import io
+    import struct
+    def pstr(s):
+        return bytes([len(s)]) + s
+    bmf = (pstr(b"mesh") + pstr(b"tex") + struct.pack("<I", 1) + pstr(b"PELVIS") +
+           struct.pack("<I3I", 1, 0, 1, 2) + struct.pack("<I5I", 1, 0, 0, 3, 0, 0) +
+           struct.pack("<I6f", 3, 0, 0, 1, 0, 0, 1) + struct.pack("<I", 0) +
+           struct.pack("<I18f", 3, *range(18)))
+    mesh = read_deformablemesh_from_stream(BinaryDataStream(io.BytesIO(bmf)))
+    arrays = read_deformablemesh_from_stream(BinaryDataStream(io.BytesIO(bmf)), as_arrays=True)
+    assert mesh.faces == [(0, 1, 2)] and arrays.faces.tolist() == [0, 1, 2]
+    assert mesh.uvcoords == [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0)]
+    for attr in ("faces", "bonebindings", "uvcoords", "blenddata", "vertices"):
+        assert [value for record in getattr(mesh, attr) for value in record] == getattr(arrays, attr).tolist()
+
+def test_read_skn_text_with_negative_values():
+    import io
+    skn = (b"mesh\r\ntex\r\n1\r\nPELVIS\r\n1\r\n0 1 2\r\n1\r\n0 0 3 -1 0\r\n"
+           b"3\r\n0 0\r\n1 0\r\n0 1\r\n0\r\n3\r\n" + b"0 0 0 0 0 1\r\n"*3)
+    mesh = read_deformablemesh_from_stream(TextDataStream(io.BytesIO(skn)))
+    assert mesh.bonebindings == [(0, 0, 3, -1, 0)]
+    assert read_deformablemesh_from_stream(TextDataStream(io.BytesIO(skn)), as_arrays=True).bonebindings.tolist() == [0, 0, 3, -1, 0]
+
+def test_read_skn_text_floats_exactly():
+    import io
+    skn = (b"mesh\r\ntex\r\n1\r\nPELVIS\r\n0\r\n0\r\n"
+           b"2\r\n0.1 0.2\r\n0.3 0.7\r\n0\r\n1\r\n0.1 -0.2 0.3 0.0 0.6 0.8\r\n")
+    mesh = read_deformablemesh_from_stream(TextDataStream(io.BytesIO(skn)))
+    assert mesh.uvcoords == [(0.1, 0.2), (0.3, 0.7)]
+    assert mesh.vertices == [(0.1, -0.2, 0.3, 0.0, 0.6, 0.8)]
+    arrays = read_deformablemesh_from_stream(TextDataStream(io.BytesIO(skn)), as_arrays=True)
+    assert arrays.uvcoords.tolist() == [0.1, 0.2, 0.3, 0.7]
@@ -16,9 +16,14 @@
 #The Sims™ is a trademark of Maxis and Electronic Arts.
 
 import io
+import os
+import threading
+from collections import OrderedDict
 from io import SEEK_SET, SEEK_CUR, SEEK_END
 
-class SubFile(io.IOBase):
+from . import instrumentation
+
+class SubFile(io.RawIOBase):
     '''
     Provides a read-only file-like bytes stream
     to a subrange in side a given stream
@@ -29,9 +34,22 @@ class SubFile(io.IOBase):
     instance A does some reading and before it's finished, instance B
     does some reading). To prevent errors originating from this, we
     -if necessary- reposition the stream pointer before any read operation
+
+    SubFile is a raw stream (io.RawIOBase), so it can be wrapped into an
+    io.BufferedReader to serve many small reads from a buffer, see open_subfile
+
+    A SubFile of a SubFile is collapsed into a single SubFile of the base
+    stream using absolute offsets (e.g. an IFF resource inside an IFF file
+    inside a FAR file), so reading from deeply nested subranges costs the
+    same as reading from a flat one. base_offset is the absolute offset
+    of the subrange inside base_stream.
     '''
     def __init__(self, stream, off, length):
-        io.IOBase.__init__(self)
+        io.RawIOBase.__init__(self)
+        if isinstance(stream, SubFile):
+            off = min(stream.off + off, stream.end)
+            length = min(length, stream.end - off)
+            stream = stream.stream
         self.stream = stream
         #reposition stream
         self.stream.seek(off)
@@ -55,18 +73,50 @@ class SubFile(io.IOBase):
         return line
     '''
 
-    def read(self, readlen=-1):
+    def __reposition(self):
         pos = self.stream.tell()
         if pos != self.last_readpos: #reposition
             self.stream.seek(self.last_readpos)
             pos = self.last_readpos
-        if readlen == -1: #read the rest available
-            result = self.stream.read(self.end-pos)
+            if instrumentation.active is not None:
+                instrumentation.active.count("seeks")
+        return pos
+
+    def read(self, readlen=-1):
+        pos = self.__reposition()
+        if readlen is None or readlen < 0: #read the rest available
+            result = self.stream.read(max(0, self.end-pos))
         else:
-            result = self.stream.read(min(self.end-pos, readlen))
+            result = self.stream.read(max(0, min(self.end-pos, readlen)))
         self.last_readpos = self.stream.tell()
+        if instrumentation.active is not None:
+            instrumentation.active.count("bytes_read", len(result))
         return result
 
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        '''
+        Reads into a caller-supplied buffer (bytearray, memoryview, array...)
+        @return number of bytes read
+        '''
+        view = memoryview(b).cast("B")
+        pos = self.__reposition()
+        readlen = max(0, min(self.end-pos, len(view)))
+        if hasattr(self.stream, "readinto"):
+            num = self.stream.readinto(view[:readlen])
+        else:
+            data = self.stream.read(readlen)
+            num = len(data)
+            view[:num] = data
+        self.last_readpos = pos + num
+        if instrumentation.active is not None:
+            instrumentation.active.count("bytes_read", num)
+        return num
+
+    readinto1 = readinto
+
     #...Interesting: If I include this close routine, the stream is
     #automatically closed as soon as the object is destroyed. Python
     #obviously auto-calls "close" on destruction
@@ -88,48 +138,413 @@ class SubFile(io.IOBase):
         return self.stream.readable()
 
     def readline(self, size=-1):
-        pos = self.stream.tell()
-        if pos != self.last_readpos: #reposition
-            self.stream.seek(self.last_readpos)
-            pos = self.last_readpos
-        if size == -1:
+        pos = self.__reposition()
+        if size is None or size < 0:
             size = self.length
-        size = min(size, self.end - pos)
+        size = max(0, min(size, self.end - pos))
         result = self.stream.readline(size)
         self.last_readpos = self.stream.tell()
         return result
 
     def readlines(self, hint=-1):
-        pos = self.stream.tell()
-        if pos != self.last_readpos: #reposition
-            self.stream.seek(self.last_readpos)
-            pos = self.last_readpos
-        if hint == -1:
+        pos = self.__reposition()
+        if hint is None or hint <= 0:
             hint = self.length
-        hint = min(hint, self.end - pos)
+        hint = max(0, min(hint, self.end - pos))
         result = self.stream.readlines(hint)
         self.last_readpos = self.stream.tell()
         return result
 
     def seek(self, offset, whence=SEEK_SET):
+        '''
+        Moves the position inside the subrange, clamped to [0, length].
+        The underlying stream is only repositioned on the next read.
+
+        @return new position
+        '''
         if whence == SEEK_SET:
-            self.stream.seek(min(self.end-1, offset + self.off), SEEK_SET)
+            pos = self.off + offset
         elif whence == SEEK_CUR:
-            pos = self.stream.tell()
-            if offset > 0:
-                self.stream.seek(min(self.end-pos, offset), SEEK_CUR)
-            else:
-                self.stream.seek(max(self.off-pos, offset), SEEK_CUR)
+            pos = self.last_readpos + offset
         elif whence == SEEK_END:
-            self.stream.seek(max(self.off, self.end+offset), SEEK_SET)
-        self.last_readpos = self.stream.tell()
+            pos = self.end + offset
+        else:
+            raise ValueError("invalid whence (%r)" % whence)
+        self.last_readpos = max(self.off, min(self.end, pos))
+        return self.last_readpos - self.off
 
     def seekable(self):
         return self.stream.seekable()
 
+    base_stream = property(lambda self: self.stream)
+    base_offset = property(lambda self: self.off)
+
     def tell(self):
         return self.last_readpos - self.off
         #return self.stream.tell() - self.off
 
     def writable(self):
         return False
+
+class _RangeStream(io.RawIOBase):
+    '''
+    Base class for read-only streams to the subrange [off, end) of some
+    data source which keep their own cursor (pos, absolute offset)
+    '''
+    def __init__(self, off, length):
+        io.RawIOBase.__init__(self)
+        self.off = off
+        self.length = length
+        self.end = off + length #offset of byte behind end of file
+        self.pos = off
+
+    def readall(self):
+        return self.read()
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_SET:
+            pos = self.off + offset
+        elif whence == SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == SEEK_END:
+            pos = self.end + offset
+        else:
+            raise ValueError("invalid whence (%r)" % whence)
+        self.pos = max(self.off, min(self.end, pos))
+        return self.pos - self.off
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.pos - self.off
+
+    def writable(self):
+        return False
+
+    def subrange(self, off, length):
+        '''
+        @return new stream of the same kind for the subrange [off, off+length)
+                of this stream, clamped to this stream's subrange
+        '''
+        off = min(self.off + off, self.end)
+        return self._create(off, min(length, self.end - off))
+
+    def _create(self, off, length):
+        '''
+        Has to be provided by the derived classes: creates a stream for
+        the absolute subrange [off, off+length) of the same data source
+        '''
+        raise NotImplementedError()
+
+    base_offset = property(lambda self: self.off)
+
+class BufferSubFile(_RangeStream):
+    '''
+    Provides a read-only file-like bytes stream
+    to a subrange of a buffer like bytes or a mmap object
+
+    In contrast to SubFile, no system calls are issued: Reading
+    only copies the requested bytes out of the buffer and seeking
+    just moves our own cursor. getbuffer() gives access to the whole
+    subrange as a memoryview without copying anything at all.
+    '''
+    def __init__(self, buf, off=0, length=None):
+        if length is None:
+            length = len(buf) - off
+        _RangeStream.__init__(self, off, length)
+        self.buf = buf
+
+    def _create(self, off, length):
+        return BufferSubFile(self.buf, off, length)
+
+    def getbuffer(self):
+        '''
+        @return memoryview of the complete subrange (read-only if the buffer is)
+        '''
+        return memoryview(self.buf)[self.off:self.end]
+
+    def read(self, readlen=-1):
+        if readlen is None or readlen < 0:
+            stop = self.end
+        else:
+            stop = min(self.end, self.pos + readlen)
+        result = self.buf[self.pos:stop]
+        self.pos = max(self.pos, stop)
+        return bytes(result)
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        stop = min(self.end, self.pos + len(view))
+        num = max(0, stop - self.pos)
+        view[:num] = memoryview(self.buf)[self.pos:self.pos+num]
+        self.pos += num
+        return num
+
+    def readline(self, size=-1):
+        stop = self.end
+        if size is not None and size >= 0:
+            stop = min(stop, self.pos + size)
+        newline = self.buf.find(b"\n", self.pos, stop)
+        if newline != -1:
+            stop = newline + 1
+        return self.read(stop - self.pos)
+
+class PositionalSubFile(_RangeStream):
+    '''
+    Provides a read-only file-like bytes stream
+    to a subrange of a physical file
+
+    Reads are done with os.pread at absolute offsets. The file position of
+    the file descriptor is never used, every instance keeps its own cursor.
+    Therefore any number of instances can read from the same file descriptor
+    at the same time, also from different threads, and a read costs exactly
+    one system call. A single instance must not be shared between threads
+    without locking though, like any other stream.
+    '''
+    def __init__(self, fd, off=0, length=None):
+        '''
+        @param fd file descriptor or object providing fileno(). It is not closed by this object
+        @param length if None, the subrange reaches up to the end of the file
+        '''
+        if not isinstance(fd, int):
+            fd = fd.fileno()
+        if length is None:
+            length = max(0, os.fstat(fd).st_size - off)
+        _RangeStream.__init__(self, off, length)
+        self.fd = fd
+
+    def read(self, readlen=-1):
+        if readlen is None or readlen < 0:
+            readlen = self.end - self.pos
+        readlen = max(0, min(readlen, self.end - self.pos))
+        result = os.pread(self.fd, readlen, self.pos)
+        while 0 < len(result) < readlen: #short read, try to get the rest
+            more = os.pread(self.fd, readlen - len(result), self.pos + len(result))
+            if not more:
+                break
+            result += more
+        self.pos += len(result)
+        if instrumentation.active is not None:
+            instrumentation.active.count("bytes_read", len(result))
+        return result
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        readlen = max(0, min(len(view), self.end - self.pos))
+        if hasattr(os, "preadv"):
+            num = os.preadv(self.fd, [view[:readlen]], self.pos)
+        else:
+            data = os.pread(self.fd, readlen, self.pos)
+            num = len(data)
+            view[:num] = data
+        self.pos += num
+        if instrumentation.active is not None:
+            instrumentation.active.count("bytes_read", num)
+        return num
+
+    def readline(self, size=-1):
+        limit = self.end - self.pos
+        if size is not None and size >= 0:
+            limit = min(limit, size)
+        chunks = []
+        num = 0
+        while num < limit:
+            chunk = os.pread(self.fd, min(256, limit - num), self.pos + num)
+            if not chunk:
+                break
+            newline = chunk.find(b"\n")
+            if newline != -1:
+                chunk = chunk[:newline+1]
+            chunks.append(chunk)
+            num += len(chunk)
+            if newline != -1:
+                break
+        self.pos += num
+        return b"".join(chunks)
+
+    def _create(self, off, length):
+        return PositionalSubFile(self.fd, off, length)
+
+    def fileno(self):
+        return self.fd
+
+class BlockCache(object):
+    '''
+    Shared read-ahead cache for one underlying seekable stream
+
+    The stream is read in aligned blocks of block_size bytes which are
+    kept in a LRU list until their total size exceeds max_bytes. All
+    CachedSubFile streams created from one BlockCache (see open() and
+    open_subfile) share these blocks, so the many tiny reads of the
+    parsers are served from memory and the same pages are only fetched
+    once. Consecutive missing blocks are fetched with a single read.
+
+    hits, misses and evictions count blocks, bytes_read counts bytes read from
+    the underlying stream.
+
+    Access to the underlying stream is serialized with a lock, so the
+    cache may be shared between threads.
+    '''
+    def __init__(self, stream, block_size=64*1024, max_bytes=16*1024*1024):
+        '''
+        @param stream seekable stream. It must not be used by anyone else while
+                      the cache is alive, else cached blocks may be stale
+        '''
+        self.stream = stream
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict() #block number -> bytes, least recently used first
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.lock = threading.Lock()
+        with self.lock:
+            self.size = stream.seek(0, SEEK_END)
+
+    def open(self):
+        '''
+        @return CachedSubFile for the complete underlying stream
+        '''
+        return CachedSubFile(self, 0, self.size)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes_read": self.bytes_read, "cached_bytes": self.cached_bytes}
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.cached_bytes = 0
+
+    def read_at(self, off, size):
+        '''
+        @return up to size bytes starting at absolute offset off
+        '''
+        size = min(size, self.size - off)
+        if size <= 0:
+            return b""
+        first = off // self.block_size
+        last = (off + size - 1) // self.block_size
+        with self.lock:
+            blocks = [self.blocks.get(number) for number in range(first, last+1)]
+            number = first
+            while number <= last:
+                if blocks[number-first] is not None:
+                    self.hits += 1
+                    if instrumentation.active is not None:
+                        instrumentation.active.count("cache_hits")
+                    self.blocks.move_to_end(number)
+                    number += 1
+                    continue
+                run_end = number
+                while run_end < last and blocks[run_end+1-first] is None:
+                    run_end += 1
+                self.__fetch(number, run_end, blocks, first)
+                number = run_end + 1
+            self.__evict()
+        if first == last:
+            start = off - first*self.block_size
+            return blocks[0][start:start+size]
+        data = b"".join(blocks)
+        start = off - first*self.block_size
+        return data[start:start+size]
+
+    def __fetch(self, first_missing, last_missing, blocks, first):
+        self.stream.seek(first_missing*self.block_size)
+        data = self.stream.read((last_missing - first_missing + 1)*self.block_size)
+        self.bytes_read += len(data)
+        if instrumentation.active is not None:
+            instrumentation.active.count("seeks")
+            instrumentation.active.count("bytes_read", len(data))
+            instrumentation.active.count("cache_misses", last_missing - first_missing + 1)
+        for number in range(first_missing, last_missing+1):
+            start = (number - first_missing)*self.block_size
+            block = data[start:start+self.block_size]
+            self.misses += 1
+            self.blocks[number] = block
+            self.cached_bytes += len(block)
+            blocks[number-first] = block
+
+    def __evict(self):
+        while self.cached_bytes > self.max_bytes and len(self.blocks) > 1:
+            number, block = self.blocks.popitem(last=False)
+            self.cached_bytes -= len(block)
+            self.evictions += 1
+
+class CachedSubFile(_RangeStream):
+    '''
+    Provides a read-only file-like bytes stream
+    to a subrange of a stream which is read through a BlockCache
+    '''
+    def __init__(self, cache, off=0, length=None):
+        if length is None:
+            length = cache.size - off
+        _RangeStream.__init__(self, off, length)
+        self.cache = cache
+
+    def _create(self, off, length):
+        return CachedSubFile(self.cache, off, length)
+
+    def read(self, readlen=-1):
+        if readlen is None or readlen < 0:
+            readlen = self.end - self.pos
+        result = self.cache.read_at(self.pos, max(0, min(readlen, self.end - self.pos)))
+        self.pos += len(result)
+        return result
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        limit = self.end - self.pos
+        if size is not None and size >= 0:
+            limit = min(limit, size)
+        chunks = []
+        num = 0
+        while num < limit:
+            block_rest = self.cache.block_size - (self.pos + num) % self.cache.block_size
+            chunk = self.cache.read_at(self.pos + num, min(block_rest, limit - num))
+            if not chunk:
+                break
+            newline = chunk.find(b"\n")
+            if newline != -1:
+                chunk = chunk[:newline+1]
+            chunks.append(chunk)
+            num += len(chunk)
+            if newline != -1:
+                break
+        self.pos += num
+        return b"".join(chunks)
+
+def open_subfile(stream, off, length, buffer_size=None):
+    '''
+    Creates a read-only stream for the subrange [off, off+length) of stream,
+    choosing the stream type best suited for the kind of stream given.
+
+    For streams over buffers (BufferSubFile), positional streams
+    (PositionalSubFile) and cached streams (CachedSubFile), the new stream
+    addresses the buffer, file or cache directly, so stacking subranges does
+    not cost anything on read and the new stream does not share any state
+    with stream. Stacked SubFiles are collapsed as well (see SubFile).
+
+    @param buffer_size if given, the stream is wrapped into an io.BufferedReader
+                       with a buffer of that size. Parsers issuing lots of tiny
+                       reads then only cause a read on the underlying stream
+                       every buffer_size bytes.
+    '''
+    if isinstance(stream, _RangeStream):
+        subfile = stream.subrange(off, length)
+    else:
+        subfile = SubFile(stream, off, length)
+    if buffer_size is not None:
+        return io.BufferedReader(subfile, buffer_size)
+    return subfile
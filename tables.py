@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (C) 2014, 2015 Fabian Hachenberg
+
+#This file is part of PySims Lib.
+#PySims Lib is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#More information about the license is provided in the LICENSE file.
+
+#PySims Lib is based on the thorough description of game data formats
+#in The Sims™ done by Dave Baum, Greg Noel and Peter Gould (and others).
+#Their online documentation and implementation in C is available at
+#http://simtech.sourceforge.net/home/welcome.html
+#The Sims™ is a trademark of Maxis and Electronic Arts.
+
+'''
+Compact tables for the indices of FAR and IFF files
+
+Instead of one Python object per FAR manifest entry or IFF resource,
+the tables store every property in a column (array.array) and strings
+in a StringPool, which can be shared between tables. Indexing or
+iterating a table yields lightweight row views (__slots__) providing
+the same properties as the former per-entry objects.
+
+If NumPy is available, columns can be accessed as NumPy arrays without
+copying (column()) and select() filters the rows vectorised.
+'''
+
+from array import array
+from fnmatch import fnmatchcase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class StringPool(object):
+    '''
+    Stores every distinct string once, tables refer to strings by their id
+    '''
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, string):
+        '''
+        @return id of string, adding it to the pool if necessary
+        '''
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+class TableRow(object):
+    '''
+    Lightweight view of one row of a table. Two rows are equal if they
+    refer to the same row of the same table.
+    '''
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, TableRow) and self.table is other.table and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+class ColumnTable(object):
+    '''
+    Base class for the tables. Derived classes list their columns as
+    (name, array typecode) tuples in columns and provide a Row class.
+    '''
+    columns = ()
+
+    def __init__(self, pool=None):
+        '''
+        @param pool StringPool to store strings in. If None, the table gets its own pool
+        '''
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        self.pool = pool if pool is not None else StringPool()
+
+    def column(self, name):
+        '''
+        @return the column as NumPy array sharing memory with the table if NumPy
+                is available, else the array.array itself
+        '''
+        column = getattr(self, name)
+        if numpy is None:
+            return column
+        return numpy.frombuffer(column, dtype=column.typecode) if len(column) else numpy.zeros(0, dtype=column.typecode)
+
+    def __len__(self):
+        return len(getattr(self, self.columns[0][0]))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("table index out of range")
+        return self.Row(self, index)
+
+    def __iter__(self):
+        Row = self.Row
+        for index in range(len(self)):
+            yield Row(self, index)
+
+class ResourceTable(ColumnTable):
+    '''
+    Base class of tables of IFF resources, provides filtering by
+    ResourceQuery (see iff.py)
+    '''
+    def _name_matches(self, indices, pattern):
+        return [index for index in indices if fnmatchcase(self.name(index), pattern)]
+
+    def select(self, query):
+        '''
+        @param query object with properties typecode, resid (int, range or None),
+                     flags_mask, flags and name (pattern or None), e.g. iff.ResourceQuery
+        @return list of the indices of all matching rows in table order
+        '''
+        if query.typecode is not None and query.typecode not in self.pool.ids:
+            return []
+        if numpy is None:
+            return self._select_python(query)
+
+        mask = numpy.ones(len(self), dtype=bool)
+        if query.typecode is not None:
+            mask &= self.column("typecode_ids") == self.pool.ids[query.typecode]
+        if query.resid is not None:
+            resids = self.column("resids")
+            if isinstance(query.resid, range):
+                r = query.resid
+                if r.step > 0:
+                    mask &= (resids >= r.start) & (resids < r.stop)
+                else:
+                    mask &= (resids <= r.start) & (resids > r.stop)
+                mask &= (resids.astype(numpy.int64) - r.start) % r.step == 0
+            else:
+                mask &= resids == query.resid
+        if query.flags_mask:
+            mask &= (self.column("flags") & query.flags_mask) == query.flags
+        elif query.flags:
+            return []
+        indices = [int(index) for index in numpy.flatnonzero(mask)]
+        if query.name is not None:
+            indices = self._name_matches(indices, query.name)
+        return indices
+
+    def _select_python(self, query):
+        typecode_id = self.pool.ids.get(query.typecode)
+        indices = []
+        for index, (t, resid, flags) in enumerate(zip(self.typecode_ids, self.resids, self.flags)):
+            if query.typecode is not None and t != typecode_id:
+                continue
+            if query.resid is not None:
+                if isinstance(query.resid, range):
+                    if resid not in query.resid:
+                        continue
+                elif resid != query.resid:
+                    continue
+            if flags & query.flags_mask != query.flags:
+                continue
+            indices.append(index)
+        if query.name is not None:
+            indices = self._name_matches(indices, query.name)
+        return indices
+
+class ResourceMapTable(ResourceTable):
+    '''
+    Entries of the resource map of an IFF file. The rows provide the
+    properties of IffResourceTypeListEntry (see iff.py).
+    '''
+    columns = (("typecode_ids", "I"), ("offsets", "I"), ("resids", "H"), ("flags", "I"), ("name_ids", "I"))
+
+    class Row(TableRow):
+        __slots__ = ()
+
+        typecode = property(lambda self: self.table.pool[self.table.typecode_ids[self.index]])
+        offset = property(lambda self: self.table.offsets[self.index])
+        resid = property(lambda self: self.table.resids[self.index])
+        flags = property(lambda self: self.table.flags[self.index])
+        name = property(lambda self: self.table.pool[self.table.name_ids[self.index]])
+
+        def __repr__(self):
+            return "ResourceMapTable.Row(typecode=%r, offset=%r, resid=%r, flags=%r, name=%r)" % (
+                self.typecode, self.offset, self.resid, self.flags, self.name)
+
+    def append(self, typecode, offset, resid, flags, name):
+        self.typecode_ids.append(self.pool.intern(typecode))
+        self.offsets.append(offset)
+        self.resids.append(resid)
+        self.flags.append(flags)
+        self.name_ids.append(self.pool.intern(name))
+
+    def typecode(self, index):
+        return self.pool[self.typecode_ids[index]]
+
+    def name(self, index):
+        return self.pool[self.name_ids[index]]
+
+    def _name_matches(self, indices, pattern):
+        #evaluate pattern once per distinct name of the candidates; the pool may be
+        #shared with many other tables, so it is not searched as a whole
+        candidate_ids = set(self.name_ids[index] for index in indices)
+        matching_ids = set(name_id for name_id in candidate_ids if fnmatchcase(self.pool[name_id], pattern))
+        return [index for index in indices if self.name_ids[index] in matching_ids]
+
+    @classmethod
+    def from_entries(cls, entries, pool=None):
+        '''
+        @param entries iterable of objects with the properties typecode, offset, resid, flags and name
+        '''
+        table = cls(pool)
+        for entry in entries:
+            table.append(entry.typecode, entry.offset, entry.resid, entry.flags, entry.name)
+        return table
+
+class ResourceHeaderTable(ResourceTable):
+    '''
+    Resource headers of an IFF file as found by iff.scan_resource_headers.
+    The rows provide the properties of IffResourceHeader plus offset.
+
+    Names are kept as the raw 64 byte name fields and only decoded when accessed.
+    '''
+    columns = (("typecode_ids", "I"), ("sizes", "I"), ("resids", "H"), ("flags", "H"), ("offsets", "I"))
+    name_length = 64
+
+    class Row(TableRow):
+        __slots__ = ()
+
+        typecode = property(lambda self: self.table.pool[self.table.typecode_ids[self.index]])
+        size = property(lambda self: self.table.sizes[self.index])     #total length header + content
+        resid = property(lambda self: self.table.resids[self.index])
+        flags = property(lambda self: self.table.flags[self.index])
+        offset = property(lambda self: self.table.offsets[self.index]) #offset of resource header from start of file
+        name = property(lambda self: self.table.name(self.index))
+
+        def __repr__(self):
+            return "ResourceHeaderTable.Row(typecode=%r, size=%r, resid=%r, flags=%r, offset=%r, name=%r)" % (
+                self.typecode, self.size, self.resid, self.flags, self.offset, self.name)
+
+    def __init__(self, pool=None):
+        ColumnTable.__init__(self, pool)
+        self.raw_names = bytearray()
+
+    def append(self, typecode_buf, size, resid, flags, offset, namebuf):
+        self.typecode_ids.append(self.pool.intern(bytes(typecode_buf).decode('ascii')))
+        self.sizes.append(size)
+        self.resids.append(resid)
+        self.flags.append(flags)
+        self.offsets.append(offset)
+        self.raw_names += namebuf
+
+    def typecode(self, index):
+        return self.pool[self.typecode_ids[index]]
+
+    def name(self, index):
+        #XXXX resources can contain garbage as name, see iff.read_resource_header_from_stream
+        if self.typecode(index) == 'XXXX':
+            return ""
+        start = index*self.name_length
+        return self.raw_names[start:start+self.name_length].decode('ascii').rstrip('\0')
+
+class FarManifestTable(ColumnTable):
+    '''
+    Entries of the manifest of a FAR file. The rows provide the
+    properties of FarFile.FarFileEntry (see far.py).
+    '''
+    columns = (("filename_ids", "I"), ("offs", "I"), ("len1s", "I"), ("len2s", "I"))
+
+    class Row(TableRow):
+        __slots__ = ()
+
+        filename = property(lambda self: self.table.pool[self.table.filename_ids[self.index]])
+        off = property(lambda self: self.table.offs[self.index])
+        len1 = property(lambda self: self.table.len1s[self.index])
+        len2 = property(lambda self: self.table.len2s[self.index])
+
+        def __repr__(self):
+            return "FarManifestTable.Row(filename=%r, off=%r, len1=%r, len2=%r)" % (
+                self.filename, self.off, self.len1, self.len2)
+
+    def append(self, filename, off, len1, len2):
+        self.filename_ids.append(self.pool.intern(filename))
+        self.offs.append(off)
+        self.len1s.append(len1)
+        self.len2s.append(len2)
+
+    def filename(self, index):
+        return self.pool[self.filename_ids[index]]
+
+    @classmethod
+    def from_entries(cls, entries, pool=None):
+        '''
+        @param entries iterable of objects with the properties filename, off, len1 and len2
+        '''
+        table = cls(pool)
+        for entry in entries:
+            table.append(entry.filename, entry.off, entry.len1, entry.len2)
+        return table
@@ -24,10 +24,12 @@ from .iff import IffFile
 from .far import FarFile
 
 from .skn_bmf import read_deformablemesh_from_stream
-from .cmx_bcf import read_characterdata_from_datastream
+from .cmx_bcf import read_characterdata_from_stream, read_characterdata_from_datastream, read_characterdata_from_buffer
 from .cfp import read_animdta_from_cfp_stream
 from .datastream import BinaryDataStream
 
+import io
+
 def test_smoketest_maid_iff_file():
     stream = open(gamedata_for_tests.objects_far_filename, "rb")
     farfile = FarFile(stream)
@@ -58,6 +60,25 @@ def test_smoketest_bcf_file_for_adult_skeleton():
     obj = read_characterdata_from_datastream(BinaryDataStream(bcf_stream))
     assert len(obj.sceletons) == 1
 
+def test_bcf_file_from_buffer_for_adult_skeleton():
+    stream = open(gamedata_for_tests.animation_far_filename, "rb")
+    farfile = FarFile(stream)
+    data = farfile.open("adult-skeleton.cmx.bcf", stream).read()
+    obj = read_characterdata_from_buffer(memoryview(data))
+    assert repr(obj) == repr(read_characterdata_from_datastream(BinaryDataStream(io.BytesIO(data))))
+
+def test_lazy_bcf_file_for_adult_skeleton():
+    stream = open(gamedata_for_tests.animation_far_filename, "rb")
+    farfile = FarFile(stream)
+    obj = read_characterdata_from_stream(farfile.open("adult-skeleton.cmx.bcf", stream))
+    lazy_obj = read_characterdata_from_stream(farfile.open("adult-skeleton.cmx.bcf", stream), lazy=True)
+    assert repr(lazy_obj.sceletons) == repr(obj.sceletons)
+    assert repr(list(lazy_obj.skills)) == repr(obj.skills)
+    skill = obj.skills[len(obj.skills)//2]
+    assert repr(lazy_obj.skills.get(skill.name)) == repr(skill)
+    assert lazy_obj.skills.get(skill.name) is lazy_obj.skills.get(skill.name)
+    assert lazy_obj.skills.get("no such skill") is None
+
 def test_smoketest_cfp_file_for_sink_wash_dishes_start():
     stream = open(gamedata_for_tests.animation_far_filename, "rb")
     farfile = FarFile(stream)